@@ -0,0 +1,176 @@
+"""Per-update CPU cost of admin intent matching and media extraction.
+
+Compares the sequential inline re.match chain and the per-handler media
+if/elif chains that bot/main.py used before bot/intents.py and bot/media.py
+with the bot's own ADMIN_INTENTS table and media helpers.
+Run from the repository root:
+
+    python -m benchmarks.bench_dispatch [-n 200000]
+"""
+import argparse
+import re
+import timeit
+
+from telegram import Message
+
+from bot import main as botmain
+from bot import media
+
+ADMIN_TEXTS = [
+    "reply 123456789",
+    "پاسخ 123456789",
+    "ban 123456789 spam links",
+    "بن 123456789",
+    "رفع بن 123456789",
+    "unban 123456789",
+    "who 123456789",
+    "اطلاعات 123456789",
+    "stats",
+    "آمار",
+    "cancel",
+    "لغو",
+    "qr: Thanks, we are looking into it.",
+    "پاسخ سریع: ممنون از پیام شما",
+    # reply-mode text: falls through every intent
+    "Hello! Your order has shipped and should arrive on Tuesday.",
+    "سلام، سفارش شما ارسال شد و تا سه‌شنبه می‌رسد.",
+]
+
+
+# -------- Before --------
+def legacy_intent(text: str):
+    m1 = re.match(r"^(reply|پاسخ)\s+(\d+)$", text, flags=re.IGNORECASE)
+    if m1:
+        return "reply", (m1.group(2),)
+    m2 = re.match(r"^(ban|بن)\s+(\d+)(?:\s+(.+))?$", text, flags=re.IGNORECASE)
+    if m2:
+        return "ban", (m2.group(2), m2.group(3))
+    m3 = re.match(r"^(unban|رفع\s*بن|آنبن)\s+(\d+)$", text, flags=re.IGNORECASE)
+    if m3:
+        return "unban", (m3.group(2),)
+    m4 = re.match(r"^(who|کی|اطلاعات)\s+(\d+)$", text, flags=re.IGNORECASE)
+    if m4:
+        return "who", (m4.group(2),)
+    if re.match(r"^(stats|آمار)$", text, flags=re.IGNORECASE):
+        return "stats", ()
+    if re.match(r"^(cancel|لغو)$", text, flags=re.IGNORECASE):
+        return "cancel", ()
+    mqr = re.match(r"^(qr:|پاسخ\s*سریع:)\s*(.+)$", text, flags=re.IGNORECASE)
+    if mqr:
+        return "qr", (mqr.group(2),)
+    return None
+
+
+def legacy_inbound_media(m):
+    # inbound_user_message: metadata chain, then send-method chain
+    kind = file_id = unique_id = None
+    if m.document:
+        kind = "document"; file_id = m.document.file_id; unique_id = m.document.file_unique_id
+    elif m.photo:
+        ph = m.photo[-1]; kind = "photo"; file_id = ph.file_id; unique_id = ph.file_unique_id
+    elif m.audio:
+        kind = "audio"; file_id = m.audio.file_id; unique_id = m.audio.file_unique_id
+    elif m.video:
+        kind = "video"; file_id = m.video.file_id; unique_id = m.video.file_unique_id
+    elif m.voice:
+        kind = "voice"; file_id = m.voice.file_id; unique_id = m.voice.file_unique_id
+    method = None
+    if m.text:
+        method, kwargs = "send_message", {"text": m.text}
+    elif m.photo:
+        method, kwargs = "send_photo", {"photo": m.photo[-1].file_id, "caption": m.caption}
+    elif m.document:
+        method, kwargs = "send_document", {"document": m.document.file_id, "caption": m.caption}
+    elif m.audio:
+        method, kwargs = "send_audio", {"audio": m.audio.file_id, "caption": m.caption}
+    elif m.video:
+        method, kwargs = "send_video", {"video": m.video.file_id, "caption": m.caption}
+    elif m.voice:
+        method, kwargs = "send_voice", {"voice": m.voice.file_id, "caption": m.caption}
+    return (kind, file_id, unique_id), (method, kwargs) if method else None
+
+
+# -------- After --------
+# legacy_intent's labels for the handlers registered in bot.main.ADMIN_INTENTS
+HANDLER_NAMES = {
+    botmain._reply_intent: "reply",
+    botmain._ban_intent: "ban",
+    botmain._unban_intent: "unban",
+    botmain._who_intent: "who",
+    botmain._stats_intent: "stats",
+    botmain._cancel_intent: "cancel",
+    botmain._quick_reply_intent: "qr",
+}
+
+
+def new_intent(text: str):
+    return botmain.ADMIN_INTENTS.match(text)
+
+
+def new_inbound_media(m):
+    md = media.extract(m)
+    meta = md or (None, None, None)
+    if m.text:
+        return meta, ("send_message", {"text": m.text})
+    if md:
+        return meta, media.send_args(md[0], md[1], m.caption)
+    return meta, None
+
+
+def _messages() -> list[Message]:
+    base = {"message_id": 1, "date": 0, "chat": {"id": 5, "type": "private"}, "from": {"id": 5, "is_bot": False, "first_name": "u"}}
+    f = lambda n: {"file_id": f"F{n}", "file_unique_id": f"U{n}"}
+    extra = [
+        {"text": "hello there, I need help with my order"},
+        {"text": "another plain text message"},
+        {"text": "سلام، یک سوال داشتم"},
+        {"photo": [dict(f(1), width=90, height=90), dict(f(2), width=800, height=800)], "caption": "pic"},
+        {"document": f(3), "caption": "doc"},
+        {"audio": dict(f(4), duration=3)},
+        {"video": dict(f(5), duration=3, width=1, height=1)},
+        {"voice": dict(f(6), duration=3)},
+    ]
+    return [Message.de_json(dict(base, **e), None) for e in extra]
+
+
+def _check(msgs: list[Message]) -> None:
+    for t in ADMIN_TEXTS:
+        hit = new_intent(t)
+        assert legacy_intent(t) == (hit and (HANDLER_NAMES[hit[0]], hit[1])), t
+    for m in msgs:
+        assert legacy_inbound_media(m) == new_inbound_media(m), m.to_dict()
+
+
+def _bench(label: str, fn, inputs: list, n: int) -> float:
+    rounds = max(1, n // len(inputs))
+    t = min(timeit.repeat(lambda: [fn(x) for x in inputs], number=rounds, repeat=5))
+    per = t / (rounds * len(inputs)) * 1e9
+    print(f"  {label:<8} {per:8.0f} ns/update")
+    return per
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-n", type=int, default=200000, help="calls per measurement")
+    n = ap.parse_args().n
+    msgs = _messages()
+    _check(msgs)
+
+    print(f"Admin intent matching ({len(ADMIN_TEXTS)} texts, incl. fall-through):")
+    a = _bench("before", legacy_intent, ADMIN_TEXTS, n)
+    b = _bench("after", new_intent, ADMIN_TEXTS, n)
+    print(f"  speedup  {a / b:8.2f}x")
+    fall = ADMIN_TEXTS[-2:]
+    print("Fall-through only (reply-mode text, every intent misses):")
+    a = _bench("before", legacy_intent, fall, n)
+    b = _bench("after", new_intent, fall, n)
+    print(f"  speedup  {a / b:8.2f}x")
+    for label, group in (("text", [m for m in msgs if m.text]), ("media", [m for m in msgs if not m.text])):
+        print(f"Inbound attachment extraction + send method, {label} messages ({len(group)}):")
+        a = _bench("before", legacy_inbound_media, group, n)
+        b = _bench("after", new_inbound_media, group, n)
+        print(f"  speedup  {a / b:8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+import math
+import time
+from collections import deque
+from typing import Any, Optional
+
+from . import db as dbm
+
+WINDOWS = {"1h": 3600, "24h": 86400, "7d": 7 * 86400}
+KINDS = ("first_response", "resolution")
+
+
+def percentile(sorted_vals: list[float], q: float) -> float:
+    # Nearest-rank percentile of an already sorted list
+    if not sorted_vals:
+        return 0.0
+    k = max(0, min(len(sorted_vals) - 1, math.ceil(q / 100 * len(sorted_vals)) - 1))
+    return sorted_vals[k]
+
+
+class ResponseAnalytics:
+    # Response-time tracking fed by relay writes.
+    #
+    # record() runs inside the transaction that writes each relays row and
+    # updates the user's conversations row: the first to_admin opens a
+    # conversation, the first to_user after that completes a first_response
+    # sample. resolve_idle() closes conversations whose last word was the
+    # admin's and that stayed quiet for resolve_after seconds, adding a
+    # resolution sample.
+    #
+    # Samples are read back incrementally (by id) into per-kind deques, so
+    # reports never rescan relays and stay consistent when several processes
+    # write samples.
+
+    def __init__(self, db_path: str, resolve_after: int = 3600, max_samples: int = 100000):
+        self.db_path = db_path
+        self.resolve_after = resolve_after
+        self._samples: dict[str, deque] = {k: deque(maxlen=max_samples) for k in KINDS}
+        self._last_id = 0
+
+    # -------- Write path --------
+    def record(self, con, user_id: int, direction: str, ts: Optional[float] = None) -> None:
+        ts = int(ts if ts is not None else time.time())
+        rows = dbm.query(con, "SELECT opened_ts, first_response_ts FROM conversations WHERE user_id=?", (user_id,))
+        opened = rows[0]["opened_ts"] if rows else None
+        if direction == "to_admin":
+            if opened is None:
+                dbm.execute(
+                    con,
+                    "INSERT INTO conversations(user_id, opened_ts, first_response_ts, last_user_ts) VALUES(?, ?, NULL, ?) "
+                    "ON CONFLICT(user_id) DO UPDATE SET opened_ts=excluded.opened_ts, first_response_ts=NULL, last_user_ts=excluded.last_user_ts",
+                    (user_id, ts, ts),
+                )
+            else:
+                dbm.execute(con, "UPDATE conversations SET last_user_ts=? WHERE user_id=?", (ts, user_id))
+        elif direction == "to_user":
+            if opened is None:
+                # admin-initiated message outside an open conversation
+                dbm.execute(
+                    con,
+                    "INSERT INTO conversations(user_id, last_admin_ts) VALUES(?, ?) ON CONFLICT(user_id) DO UPDATE SET last_admin_ts=excluded.last_admin_ts",
+                    (user_id, ts),
+                )
+                return
+            if rows[0]["first_response_ts"] is None:
+                dbm.execute(con, "UPDATE conversations SET first_response_ts=?, last_admin_ts=? WHERE user_id=?", (ts, ts, user_id))
+                dbm.insert(con, "INSERT INTO response_samples(kind, seconds, ts) VALUES('first_response', ?, ?)", (ts - opened, ts))
+            else:
+                dbm.execute(con, "UPDATE conversations SET last_admin_ts=? WHERE user_id=?", (ts, user_id))
+
+    def resolve_idle(self, now: Optional[float] = None) -> int:
+        now = int(now if now is not None else time.time())
+        with dbm.connect(self.db_path) as con:
+            rows = dbm.query(
+                con,
+                "SELECT user_id, opened_ts, last_admin_ts FROM conversations "
+                "WHERE opened_ts IS NOT NULL AND first_response_ts IS NOT NULL AND last_admin_ts >= last_user_ts AND last_admin_ts <= ?",
+                (now - self.resolve_after,),
+            )
+            for r in rows:
+                dbm.insert(con, "INSERT INTO response_samples(kind, seconds, ts) VALUES('resolution', ?, ?)", (r["last_admin_ts"] - r["opened_ts"], r["last_admin_ts"]))
+                dbm.execute(con, "UPDATE conversations SET opened_ts=NULL WHERE user_id=?", (r["user_id"],))
+        return len(rows)
+
+    # -------- Read path --------
+    def refresh(self) -> None:
+        since = int(time.time()) - max(WINDOWS.values())
+        with dbm.connect(self.db_path) as con:
+            rows = dbm.query(con, "SELECT id, kind, seconds, ts FROM response_samples WHERE id > ? AND ts >= ? ORDER BY id", (self._last_id, since))
+        for r in rows:
+            if r["kind"] in self._samples:
+                self._samples[r["kind"]].append((r["ts"], r["seconds"]))
+            self._last_id = r["id"]
+        for d in self._samples.values():
+            while d and d[0][0] < since:
+                d.popleft()
+
+    def window_stats(self, kind: str, window_s: int, now: Optional[float] = None) -> dict[str, float]:
+        now = now if now is not None else time.time()
+        vals = sorted(s for ts, s in self._samples[kind] if now - ts <= window_s)
+        return {
+            "n": len(vals),
+            "p50": percentile(vals, 50),
+            "p90": percentile(vals, 90),
+            "p99": percentile(vals, 99),
+        }
+
+    def open_stats(self) -> dict[str, int]:
+        now = int(time.time())
+        with dbm.connect(self.db_path) as con:
+            r = dbm.query(
+                con,
+                "SELECT COUNT(*) AS open, "
+                "SUM(first_response_ts IS NULL) AS awaiting, "
+                "MIN(CASE WHEN first_response_ts IS NULL THEN opened_ts END) AS oldest "
+                "FROM conversations WHERE opened_ts IS NOT NULL",
+            )[0]
+        return {"open": r["open"], "awaiting": r["awaiting"] or 0, "oldest_wait_s": now - r["oldest"] if r["oldest"] else 0}
+
+    def metrics(self) -> dict[str, Any]:
+        self.refresh()
+        out: dict[str, Any] = dict(self.open_stats())
+        for kind in KINDS:
+            for wname in ("1h", "24h"):
+                st = self.window_stats(kind, WINDOWS[wname])
+                out[f"{kind}_{wname}_n"] = st["n"]
+                out[f"{kind}_{wname}_p50_s"] = st["p50"]
+                out[f"{kind}_{wname}_p90_s"] = st["p90"]
+        return out
@@ -0,0 +1,212 @@
+import time
+from typing import Any, Callable, Iterable, Optional
+
+from . import db as dbm
+
+
+class Assigner:
+    # Sticky, least-loaded assignment of user conversations to admins.
+    #
+    # The user → admin map and per-admin load live in memory, so the inbound
+    # hot path is a dict lookup; the assignments table is the durable copy and
+    # is only written when an assignment changes or a user writes in. Only open
+    # conversations are kept in memory: recount() drops the rest, and a user
+    # who writes again after that is looked up in the table.
+    #
+    # A conversation counts towards its admin's load while the user has written
+    # within open_window seconds. An admin with no activity for idle_ttl
+    # seconds stops receiving new conversations and has open ones moved away
+    # by reassign_idle() (unless every admin is idle).
+    #
+    # With several processes each keeps its own copy: on_change receives an
+    # event for every local change and apply() replays events from the others.
+    # An ownership change is announced as an "owner" event that makes the
+    # others re-read the assignments row; "inbound" events carry only the
+    # user's activity time, so a process with a stale copy never overwrites a
+    # newer assignment. Events are raised inside the caller's transaction and
+    # must be delivered after it commits.
+
+    def __init__(self, db_path: str, admin_ids: Iterable[int], idle_ttl: int = 1800, open_window: int = 86400):
+        self.db_path = db_path
+        self.admin_ids = list(admin_ids)
+        self.idle_ttl = idle_ttl
+        self.open_window = open_window
+        self.reassigned = 0
+        self._owner: dict[int, int] = {}
+        self._last_inbound: dict[int, float] = {}
+        self._load: dict[int, int] = {a: 0 for a in self.admin_ids}
+        now = time.time()
+        self._admin_seen: dict[int, float] = {a: now for a in self.admin_ids}
+        self._seen_published: dict[int, float] = {}
+        self.on_change: Optional[Callable[[dict[str, Any]], None]] = None
+
+    # -------- State --------
+    def load(self) -> None:
+        with dbm.connect(self.db_path) as con:
+            rows = dbm.query(
+                con,
+                "SELECT user_id, admin_id, last_inbound_ts FROM assignments WHERE last_inbound_ts >= ?",
+                (int(time.time() - self.open_window),),
+            )
+        self._owner = {r["user_id"]: r["admin_id"] for r in rows}
+        self._last_inbound = {r["user_id"]: float(r["last_inbound_ts"] or 0) for r in rows}
+        self.recount()
+
+    def reload_user(self, user_id: int) -> None:
+        # Pick up a change made by another process; load is adjusted in place
+        with dbm.connect(self.db_path) as con:
+            rows = dbm.query(con, "SELECT admin_id, last_inbound_ts FROM assignments WHERE user_id=?", (user_id,))
+        now = time.time()
+        if self._is_open(user_id, now) and self._owner.get(user_id) in self._load:
+            self._load[self._owner[user_id]] -= 1
+        self._owner.pop(user_id, None)
+        self._last_inbound.pop(user_id, None)
+        if rows:
+            self._owner[user_id] = rows[0]["admin_id"]
+            self._last_inbound[user_id] = float(rows[0]["last_inbound_ts"] or 0)
+            if self._is_open(user_id, now) and self._owner[user_id] in self._load:
+                self._load[self._owner[user_id]] += 1
+
+    def _publish(self, event: dict[str, Any]) -> None:
+        if self.on_change is not None:
+            self.on_change(event)
+
+    def apply(self, event: dict[str, Any]) -> None:
+        # Replay a change made by another process
+        now = time.time()
+        kind = event["kind"]
+        if kind == "admin_seen":
+            a = event["admin_id"]
+            self._admin_seen[a] = max(self._admin_seen.get(a, 0), event["ts"])
+        elif kind == "owner":
+            self.reload_user(event["user_id"])
+        elif kind == "inbound":
+            uid = event["user_id"]
+            if uid not in self._owner:
+                self.reload_user(uid)
+                return
+            was_open = self._is_open(uid, now)
+            self._last_inbound[uid] = max(self._last_inbound.get(uid, 0), float(event["ts"]))
+            if not was_open and self._is_open(uid, now) and self._owner[uid] in self._load:
+                self._load[self._owner[uid]] += 1
+
+    def recount(self, now: Optional[float] = None) -> None:
+        # Recomputes load and forgets closed conversations
+        now = now if now is not None else time.time()
+        for uid in [u for u in self._owner if not self._is_open(u, now)]:
+            del self._owner[uid]
+            self._last_inbound.pop(uid, None)
+        load = {a: 0 for a in self.admin_ids}
+        for a in self._owner.values():
+            if a in load:
+                load[a] += 1
+        self._load = load
+
+    def _is_open(self, user_id: int, now: float) -> bool:
+        return now - self._last_inbound.get(user_id, 0) < self.open_window
+
+    def _available(self, admin_id: int, now: float) -> bool:
+        return admin_id in self._load and now - self._admin_seen.get(admin_id, 0) < self.idle_ttl
+
+    def _stored_owner(self, con, user_id: int) -> Optional[int]:
+        # Owner of a conversation not kept in memory (closed, or never seen)
+        if user_id in self._owner:
+            return self._owner[user_id]
+        rows = dbm.query(con, "SELECT admin_id FROM assignments WHERE user_id=?", (user_id,))
+        if not rows:
+            return None
+        self._owner[user_id] = rows[0]["admin_id"]
+        return self._owner[user_id]
+
+    def _pick(self, now: float, exclude: Optional[int] = None) -> int:
+        pool = [a for a in self.admin_ids if a != exclude and self._available(a, now)]
+        if not pool:
+            pool = [a for a in self.admin_ids if a != exclude] or self.admin_ids
+        # ties go to the earlier admin in ADMIN_IDS order
+        return min(pool, key=lambda a: (self._load[a], self.admin_ids.index(a)))
+
+    def _move(self, con, user_id: int, admin_id: int, now: float) -> None:
+        old = self._owner.get(user_id)
+        if old == admin_id:
+            return
+        if self._is_open(user_id, now):
+            if old in self._load:
+                self._load[old] -= 1
+            self._load[admin_id] += 1
+        self._owner[user_id] = admin_id
+        dbm.execute(
+            con,
+            "INSERT INTO assignments(user_id, admin_id, assigned_at, last_inbound_ts) VALUES(?, ?, CURRENT_TIMESTAMP, ?) "
+            "ON CONFLICT(user_id) DO UPDATE SET admin_id=excluded.admin_id, assigned_at=CURRENT_TIMESTAMP",
+            (user_id, admin_id, int(self._last_inbound.get(user_id, 0))),
+        )
+        self._publish({"kind": "owner", "user_id": user_id})
+
+    # -------- Hot path --------
+    def admin_for(self, con, user_id: int) -> int:
+        # Called inside the inbound transaction; records the user's activity too
+        now = time.time()
+        current = self._stored_owner(con, user_id)
+        if current is None or not self._available(current, now):
+            self._move(con, user_id, self._pick(now, exclude=current), now)
+        if not self._is_open(user_id, now):
+            self._load[self._owner[user_id]] += 1
+        self._last_inbound[user_id] = now
+        dbm.execute(con, "UPDATE assignments SET last_inbound_ts=? WHERE user_id=?", (int(now), user_id))
+        self._publish({"kind": "inbound", "user_id": user_id, "ts": now})
+        return self._owner[user_id]
+
+    def on_duty(self) -> list[int]:
+        # Admins currently taking conversations; the primary admin if none is
+        now = time.time()
+        return [a for a in self.admin_ids if self._available(a, now)] or self.admin_ids[:1]
+
+    def touch_admin(self, admin_id: int) -> None:
+        now = time.time()
+        self._admin_seen[admin_id] = now
+        # other processes only need this at idle_ttl resolution
+        if now - self._seen_published.get(admin_id, 0) >= 10:
+            self._seen_published[admin_id] = now
+            self._publish({"kind": "admin_seen", "admin_id": admin_id, "ts": now})
+
+    def claim(self, con, user_id: int, admin_id: int) -> bool:
+        # The admin who answers a conversation keeps it
+        if admin_id not in self._load or self._stored_owner(con, user_id) == admin_id:
+            return False
+        self._move(con, user_id, admin_id, time.time())
+        return True
+
+    def reassign(self, con, user_id: int, admin_id: int) -> None:
+        self._move(con, user_id, admin_id, time.time())
+
+    def reassign_idle(self) -> list[tuple[int, int, int]]:
+        # (user_id, old admin, new admin) for each open conversation moved
+        if len(self.admin_ids) < 2:
+            return []
+        now = time.time()
+        self.recount(now)
+        idle = {a for a in self.admin_ids if not self._available(a, now)}
+        if not idle or len(idle) == len(self.admin_ids):
+            return []
+        moved = []
+        with dbm.connect(self.db_path) as con:
+            for uid, a in list(self._owner.items()):
+                if (a in idle or a not in self._load) and self._is_open(uid, now):
+                    new = self._pick(now, exclude=a)
+                    self._move(con, uid, new, now)
+                    moved.append((uid, a, new))
+        self.reassigned += len(moved)
+        return moved
+
+    def report(self) -> list[dict[str, Any]]:
+        now = time.time()
+        return [
+            {"admin_id": a, "open": self._load[a], "idle_s": int(now - self._admin_seen.get(a, 0)), "available": self._available(a, now)}
+            for a in self.admin_ids
+        ]
+
+    def metrics(self) -> dict[str, Any]:
+        out: dict[str, Any] = {"tracked": len(self._owner), "reassigned": self.reassigned}
+        for a in self.admin_ids:
+            out[f"open_{a}"] = self._load[a]
+        return out
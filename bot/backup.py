@@ -0,0 +1,145 @@
+import asyncio
+import gzip
+import os
+import shutil
+import sqlite3
+import time
+from datetime import datetime
+from typing import Any, Optional
+
+from . import db as dbm
+
+SNAPSHOT_PREFIX = "bot-"
+
+
+class _Restarting(Exception):
+    pass
+
+
+def _copy(db_path: str, dest: str, pages: int, sleep: float, max_restarts: int = 3) -> bool:
+    # Online copy in steps of `pages`. A commit from any other connection
+    # between two steps restarts the copy from page one (`sleep` only applies
+    # when a step hits BUSY/LOCKED), so under steady writes a stepped copy may
+    # never finish. After max_restarts it is redone in a single step, which in
+    # WAL mode reads one snapshot without blocking writers (checkpoints wait).
+    # Returns True if that fallback was needed. Runs in a worker thread.
+    src = dbm.open_connection(db_path)
+    dst = sqlite3.connect(dest)
+    remaining: list[int] = []
+
+    def progress(status: int, left: int, total: int) -> None:
+        # remaining only goes down between steps unless the copy restarted
+        if remaining and left >= remaining[-1]:
+            remaining.append(-1)
+            if remaining.count(-1) > max_restarts:
+                raise _Restarting()
+        remaining.append(left)
+
+    try:
+        try:
+            src.backup(dst, pages=pages, progress=progress, sleep=sleep)
+            return False
+        except _Restarting:
+            src.backup(dst, pages=-1, sleep=sleep)
+            return True
+    finally:
+        dst.close()
+        src.close()
+
+
+def _integrity_ok(path: str) -> tuple[bool, str]:
+    con = sqlite3.connect(path)
+    try:
+        rows = con.execute("PRAGMA integrity_check").fetchall()
+    finally:
+        con.close()
+    msg = "; ".join(r[0] for r in rows[:5])
+    return msg == "ok", msg
+
+
+def _gzip(src: str, dest: str) -> None:
+    with open(src, "rb") as fi, gzip.open(dest, "wb", compresslevel=6) as fo:
+        shutil.copyfileobj(fi, fo, 1024 * 1024)
+
+
+def list_snapshots(backup_dir: str) -> list[str]:
+    # Oldest first; timestamped names sort chronologically
+    if not os.path.isdir(backup_dir):
+        return []
+    names = [n for n in os.listdir(backup_dir) if n.startswith(SNAPSHOT_PREFIX) and (n.endswith(".db") or n.endswith(".db.gz"))]
+    return [os.path.join(backup_dir, n) for n in sorted(names)]
+
+
+def latest_snapshot(backup_dir: str) -> Optional[str]:
+    snaps = list_snapshots(backup_dir)
+    return snaps[-1] if snaps else None
+
+
+class Backups:
+    def __init__(self, db_path: str, backup_dir: str, keep: int = 7, compress: bool = True, pages: int = 1024, step_sleep: float = 0.01):
+        self.db_path = db_path
+        self.backup_dir = backup_dir
+        self.keep = max(1, keep)
+        self.compress = compress
+        self.pages = pages
+        self.step_sleep = step_sleep
+        self.stats: dict[str, Any] = {"ok": 0, "failed": 0, "single_step": 0, "last_path": "", "last_bytes": 0, "last_duration_s": 0.0, "last_error": ""}
+        self._lock = asyncio.Lock()
+
+    async def run(self) -> str:
+        # Returns the path of the verified snapshot; raises on failure
+        async with self._lock:
+            t0 = time.monotonic()
+            try:
+                path = await self._run()
+            except Exception as e:
+                self.stats["failed"] += 1
+                self.stats["last_error"] = f"{type(e).__name__}: {e}"
+                raise
+            self.stats["ok"] += 1
+            self.stats["last_path"] = path
+            self.stats["last_bytes"] = os.path.getsize(path)
+            self.stats["last_duration_s"] = round(time.monotonic() - t0, 3)
+            self.stats["last_error"] = ""
+            return path
+
+    async def _run(self) -> str:
+        os.makedirs(self.backup_dir, exist_ok=True)
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        base = os.path.join(self.backup_dir, f"{SNAPSHOT_PREFIX}{stamp}.db")
+        part = base + ".part"
+        try:
+            if await asyncio.to_thread(_copy, self.db_path, part, self.pages, self.step_sleep):
+                self.stats["single_step"] += 1
+            ok, msg = await asyncio.to_thread(_integrity_ok, part)
+            if not ok:
+                raise RuntimeError(f"integrity_check failed: {msg}")
+            if self.compress:
+                final = base + ".gz"
+                await asyncio.to_thread(_gzip, part, final + ".part")
+                os.replace(final + ".part", final)
+                os.remove(part)
+            else:
+                final = base
+                os.replace(part, final)
+        finally:
+            for p in (part, base + ".gz.part"):
+                if os.path.exists(p):
+                    os.remove(p)
+        self._rotate()
+        return final
+
+    def _rotate(self) -> None:
+        snaps = list_snapshots(self.backup_dir)
+        for p in snaps[: max(0, len(snaps) - self.keep)]:
+            os.remove(p)
+
+    def metrics(self) -> dict[str, Any]:
+        return {
+            "ok": self.stats["ok"],
+            "failed": self.stats["failed"],
+            "single_step": self.stats["single_step"],
+            "snapshots": len(list_snapshots(self.backup_dir)),
+            "last_bytes": self.stats["last_bytes"],
+            "last_duration_s": self.stats["last_duration_s"],
+        }
@@ -9,6 +9,79 @@ class Config:
     admin_id: int
     db_path: str = "data/bot.db"
     allowed_user_ids: set[int] = None  # default to {admin_id} later
+    admin_ids: list[int] = None  # admin team; admin_id first (it also gets system notices)
+    admin_idle_ttl: int = 1800  # seconds without admin activity before their conversations move
+    conversation_open_window: int = 86400  # a conversation counts towards load this long after the user's last message
+    sla_resolve_after: int = 3600  # a conversation is resolved once quiet this long after an admin reply
+    outbox_workers: int = 4
+    outbox_max_attempts: int = 8
+    outbox_lease: int = 120  # seconds an abandoned claimed row stays in 'sending' before its process retries it
+    persist_interval: int = 30  # seconds between context-data flushes
+    mem_idle_ttl: int = 86400  # seconds before an idle user's runtime state is expired
+    mem_max_users: int = 10000  # LRU cap on users with resident state
+    mem_budget_mb: int = 0  # estimated-size cap for per-user state; 0 = off
+    mem_sweep_interval: int = 300
+    flood_window: int = 120  # seconds a content hash stays live after its last copy
+    flood_threshold: int = 3  # copies allowed per window; 0 disables the filter
+    flood_min_text: int = 16  # shorter (normalized) texts are never treated as duplicates
+    flood_max_keys: int = 20000
+    # Telegram HTTP transport: separate pools for sends and getUpdates
+    tg_send_pool: int = 256
+    tg_updates_pool: int = 1
+    tg_keepalive: int = 32  # idle connections kept open per pool
+    tg_keepalive_expiry: float = 30.0
+    tg_connect_timeout: float = 5.0
+    tg_read_timeout: float = 5.0
+    tg_write_timeout: float = 5.0
+    tg_pool_timeout: float = 1.0
+    tg_http2: bool = False
+    tg_base_url: str = ""  # e.g. http://localhost:8081/bot for a local Bot API server
+    tg_base_file_url: str = ""
+    backup_dir: str = "data/backups"
+    backup_interval: int = 86400  # seconds between scheduled snapshots; 0 = off
+    backup_keep: int = 7
+    backup_compress: bool = True
+    backup_pages: int = 1024  # pages copied per backup step
+    # SQLite connection profile and WAL maintenance
+    sqlite_synchronous: str = "NORMAL"
+    sqlite_cache_kib: int = 8192
+    sqlite_mmap_mb: int = 64
+    sqlite_temp_store: str = "MEMORY"
+    sqlite_busy_timeout_ms: int = 5000
+    sqlite_wal_autocheckpoint: int = 10000
+    sqlite_checkpoint_interval: int = 30
+    sqlite_truncate_wal_mb: int = 64
+    sqlite_optimize_interval: int = 3600
+    # Multi-process mode: one polling process fans updates out to N workers
+    shard_workers: int = 0  # 0 or 1 = single process
+    shard_socket: str = "data/shard.sock"
+    shard_queue: int = 1000  # updates buffered per worker before polling waits
+
+
+def _env_int(name: str, default: int) -> int:
+    v = os.getenv(name, "").strip()
+    if not v:
+        return default
+    if not v.lstrip("-").isdigit():
+        raise RuntimeError(f"{name} must be an integer.")
+    return int(v)
+
+
+def _env_float(name: str, default: float) -> float:
+    v = os.getenv(name, "").strip()
+    if not v:
+        return default
+    try:
+        return float(v)
+    except ValueError:
+        raise RuntimeError(f"{name} must be a number.") from None
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    v = os.getenv(name, "").strip().lower()
+    if not v:
+        return default
+    return v in {"1", "true", "yes", "on"}
 
 
 def load_config() -> Config:
@@ -23,13 +96,74 @@ def load_config() -> Config:
     if not admin_id_str.isdigit():
         raise RuntimeError("ADMIN_ID must be a numeric Telegram user id.")
 
+    synchronous = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL").strip().upper()
+    if synchronous not in {"OFF", "NORMAL", "FULL", "EXTRA"}:
+        raise RuntimeError("SQLITE_SYNCHRONOUS must be one of OFF, NORMAL, FULL, EXTRA.")
+    temp_store = os.getenv("SQLITE_TEMP_STORE", "MEMORY").strip().upper()
+    if temp_store not in {"DEFAULT", "FILE", "MEMORY"}:
+        raise RuntimeError("SQLITE_TEMP_STORE must be one of DEFAULT, FILE, MEMORY.")
+
     admin_id = int(admin_id_str)
-    allowed_ids: set[int] = {admin_id}
+    admin_ids: list[int] = [admin_id]
+    for p in os.getenv("ADMIN_IDS", "").split(","):
+        p = p.strip()
+        if p.isdigit() and int(p) not in admin_ids:
+            admin_ids.append(int(p))
+    allowed_ids: set[int] = set(admin_ids)
     if allowed_ids_str:
         for p in allowed_ids_str.split(","):
             p = p.strip()
             if p.isdigit():
                 allowed_ids.add(int(p))
 
-    return Config(bot_token=token, admin_id=admin_id, db_path=db_path, allowed_user_ids=allowed_ids)
+    return Config(
+        bot_token=token,
+        admin_id=admin_id,
+        db_path=db_path,
+        allowed_user_ids=allowed_ids,
+        admin_ids=admin_ids,
+        admin_idle_ttl=_env_int("ADMIN_IDLE_TTL", 1800),
+        conversation_open_window=_env_int("CONVERSATION_OPEN_WINDOW", 86400),
+        sla_resolve_after=_env_int("SLA_RESOLVE_AFTER", 3600),
+        outbox_workers=_env_int("OUTBOX_WORKERS", 4),
+        outbox_max_attempts=_env_int("OUTBOX_MAX_ATTEMPTS", 8),
+        outbox_lease=_env_int("OUTBOX_LEASE", 120),
+        persist_interval=_env_int("PERSIST_INTERVAL", 30),
+        mem_idle_ttl=_env_int("MEM_IDLE_TTL", 86400),
+        mem_max_users=_env_int("MEM_MAX_USERS", 10000),
+        mem_budget_mb=_env_int("MEM_BUDGET_MB", 0),
+        mem_sweep_interval=_env_int("MEM_SWEEP_INTERVAL", 300),
+        flood_window=_env_int("FLOOD_WINDOW", 120),
+        flood_threshold=_env_int("FLOOD_THRESHOLD", 3),
+        flood_min_text=_env_int("FLOOD_MIN_TEXT", 16),
+        flood_max_keys=_env_int("FLOOD_MAX_KEYS", 20000),
+        tg_send_pool=_env_int("TG_SEND_POOL", 256),
+        tg_updates_pool=_env_int("TG_UPDATES_POOL", 1),
+        tg_keepalive=_env_int("TG_KEEPALIVE", 32),
+        tg_keepalive_expiry=_env_float("TG_KEEPALIVE_EXPIRY", 30.0),
+        tg_connect_timeout=_env_float("TG_CONNECT_TIMEOUT", 5.0),
+        tg_read_timeout=_env_float("TG_READ_TIMEOUT", 5.0),
+        tg_write_timeout=_env_float("TG_WRITE_TIMEOUT", 5.0),
+        tg_pool_timeout=_env_float("TG_POOL_TIMEOUT", 1.0),
+        tg_http2=_env_bool("TG_HTTP2", False),
+        tg_base_url=os.getenv("TG_BASE_URL", "").strip(),
+        tg_base_file_url=os.getenv("TG_BASE_FILE_URL", "").strip(),
+        backup_dir=os.getenv("BACKUP_DIR", "data/backups").strip(),
+        backup_interval=_env_int("BACKUP_INTERVAL", 86400),
+        backup_keep=_env_int("BACKUP_KEEP", 7),
+        backup_compress=_env_bool("BACKUP_COMPRESS", True),
+        backup_pages=_env_int("BACKUP_PAGES", 1024),
+        sqlite_synchronous=synchronous,
+        sqlite_cache_kib=_env_int("SQLITE_CACHE_KIB", 8192),
+        sqlite_mmap_mb=_env_int("SQLITE_MMAP_MB", 64),
+        sqlite_temp_store=temp_store,
+        sqlite_busy_timeout_ms=_env_int("SQLITE_BUSY_TIMEOUT_MS", 5000),
+        sqlite_wal_autocheckpoint=_env_int("SQLITE_WAL_AUTOCHECKPOINT", 10000),
+        sqlite_checkpoint_interval=_env_int("SQLITE_CHECKPOINT_INTERVAL", 30),
+        sqlite_truncate_wal_mb=_env_int("SQLITE_TRUNCATE_WAL_MB", 64),
+        sqlite_optimize_interval=_env_int("SQLITE_OPTIMIZE_INTERVAL", 3600),
+        shard_workers=_env_int("SHARD_WORKERS", 0),
+        shard_socket=os.getenv("SHARD_SOCKET", "data/shard.sock").strip(),
+        shard_queue=_env_int("SHARD_QUEUE", 1000),
+    )
 
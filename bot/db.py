@@ -1,19 +1,57 @@
 import os
 import sqlite3
 from contextlib import contextmanager
+from dataclasses import dataclass
 from typing import Any, Iterable, Optional
 
 
+@dataclass
+class Profile:
+    # Per-connection PRAGMAs applied by every connection this module opens
+    synchronous: str = "NORMAL"  # NORMAL is durable across app crashes in WAL mode
+    cache_size_kib: int = 8192
+    mmap_size_mb: int = 64
+    temp_store: str = "MEMORY"
+    busy_timeout_ms: int = 5000
+    wal_autocheckpoint: int = 10000  # pages; background checkpoints normally run first
+
+    def pragmas(self) -> str:
+        return (
+            f"PRAGMA synchronous={self.synchronous};"
+            f"PRAGMA cache_size=-{int(self.cache_size_kib)};"
+            f"PRAGMA mmap_size={int(self.mmap_size_mb) * 1024 * 1024};"
+            f"PRAGMA temp_store={self.temp_store};"
+            f"PRAGMA busy_timeout={int(self.busy_timeout_ms)};"
+            f"PRAGMA wal_autocheckpoint={int(self.wal_autocheckpoint)};"
+        )
+
+
+_profile = Profile()
+_pragmas = _profile.pragmas()
+
+
+def configure(profile: Profile) -> None:
+    global _profile, _pragmas
+    _profile = profile
+    _pragmas = profile.pragmas()
+
+
 def ensure_dir(path: str) -> None:
     d = os.path.dirname(path)
     if d and not os.path.exists(d):
         os.makedirs(d, exist_ok=True)
 
 
+def open_connection(db_path: str) -> sqlite3.Connection:
+    ensure_dir(db_path)
+    con = sqlite3.connect(db_path, timeout=_profile.busy_timeout_ms / 1000)
+    con.executescript(_pragmas)
+    return con
+
+
 @contextmanager
 def connect(db_path: str):
-    ensure_dir(db_path)
-    con = sqlite3.connect(db_path)
+    con = open_connection(db_path)
     try:
         con.row_factory = sqlite3.Row
         yield con
@@ -95,8 +133,88 @@ def init_db(db_path: str) -> None:
               peer_msg_id INTEGER,     -- original msg id in user chat
               created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             );
+
+            CREATE TABLE IF NOT EXISTS outbox (
+              id INTEGER PRIMARY KEY AUTOINCREMENT,
+              dedup_key TEXT NOT NULL UNIQUE,
+              chat_id INTEGER NOT NULL,
+              method TEXT NOT NULL,        -- Bot API method, e.g. 'send_message'
+              payload TEXT NOT NULL,       -- JSON: {"kwargs": {...}, "followups": [...]}
+              relay_user_id INTEGER,       -- relays row written on success
+              relay_direction TEXT,        -- 'to_admin' / 'to_user' / NULL
+              relay_msg_id INTEGER,        -- known side of the relay (peer or admin msg id)
+              status TEXT NOT NULL DEFAULT 'pending', -- pending / sending / sent / dead
+              attempts INTEGER NOT NULL DEFAULT 0,
+              next_attempt_ts INTEGER NOT NULL DEFAULT 0,
+              last_error TEXT,
+              created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+              sent_at TIMESTAMP
+            );
+            CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox(status, next_attempt_ts);
+            CREATE INDEX IF NOT EXISTS idx_outbox_chat ON outbox(chat_id, status, id);
+
+            CREATE TABLE IF NOT EXISTS context_data (
+              scope TEXT NOT NULL,         -- 'user' / 'chat' / 'bot'
+              owner_id INTEGER NOT NULL,   -- user id / chat id / 0 for bot_data
+              key TEXT NOT NULL,
+              value TEXT NOT NULL,         -- JSON
+              PRIMARY KEY (scope, owner_id, key)
+            ) WITHOUT ROWID;
+
+            CREATE TABLE IF NOT EXISTS assignments (
+              user_id INTEGER PRIMARY KEY,
+              admin_id INTEGER NOT NULL,   -- admin currently handling this user's conversation
+              assigned_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+              last_inbound_ts INTEGER      -- last message from the user (epoch)
+            );
+
+            CREATE TABLE IF NOT EXISTS conversations (
+              user_id INTEGER PRIMARY KEY,
+              opened_ts INTEGER,           -- first unanswered user message (epoch); NULL = no open conversation
+              first_response_ts INTEGER,   -- first admin reply after opened_ts
+              last_user_ts INTEGER,
+              last_admin_ts INTEGER
+            );
+            CREATE INDEX IF NOT EXISTS idx_conversations_open ON conversations(opened_ts);
+
+            CREATE TABLE IF NOT EXISTS response_samples (
+              id INTEGER PRIMARY KEY AUTOINCREMENT,
+              kind TEXT NOT NULL,          -- 'first_response' / 'resolution'
+              seconds INTEGER NOT NULL,
+              ts INTEGER NOT NULL          -- when the sample completed (epoch)
+            );
+            CREATE INDEX IF NOT EXISTS idx_response_samples_ts ON response_samples(ts);
+
+            -- duplicate-content counters shared by shard workers (flood.SharedFloodFilter)
+            CREATE TABLE IF NOT EXISTS flood_keys (
+              key TEXT PRIMARY KEY,        -- content_key() hash
+              first_ts REAL NOT NULL,
+              last_ts REAL NOT NULL,
+              count INTEGER NOT NULL DEFAULT 0,
+              suppressed INTEGER NOT NULL DEFAULT 0,
+              pending INTEGER NOT NULL DEFAULT 0,  -- suppressed since the last admin notice
+              preview TEXT
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS idx_flood_keys_last ON flood_keys(last_ts);
+            CREATE TABLE IF NOT EXISTS flood_users (
+              key TEXT NOT NULL,
+              user_id INTEGER NOT NULL,
+              PRIMARY KEY (key, user_id)
+            ) WITHOUT ROWID;
             """
         )
+        # Columns added after the first release
+        add_column(con, "relays", "admin_id", "INTEGER")  # admin chat of admin_msg_id; NULL = primary admin
+        add_column(con, "outbox", "relay_admin_id", "INTEGER")
+        add_column(con, "outbox", "claimed_at", "INTEGER")  # when the row last went to 'sending' (lease start)
+        add_column(con, "outbox", "claimed_by", "TEXT")  # Outbox.owner of that claim, e.g. shard-2
+        con.execute("CREATE INDEX IF NOT EXISTS idx_relays_admin_msg ON relays(admin_msg_id)")
+
+
+def add_column(con: sqlite3.Connection, table: str, column: str, decl: str) -> None:
+    cols = {r[1] for r in con.execute(f"PRAGMA table_info({table})").fetchall()}
+    if column not in cols:
+        con.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
 
 
 def insert(con: sqlite3.Connection, sql: str, params: Iterable[Any]) -> int:
@@ -112,3 +230,37 @@ def query(con: sqlite3.Connection, sql: str, params: Iterable[Any] = ()) -> list
 def execute(con: sqlite3.Connection, sql: str, params: Iterable[Any] = ()) -> int:
     cur = con.execute(sql, params)
     return cur.rowcount
+
+
+# -------- WAL maintenance --------
+def wal_size(db_path: str) -> int:
+    try:
+        return os.path.getsize(db_path + "-wal")
+    except OSError:
+        return 0
+
+
+def checkpoint(db_path: str, mode: str = "PASSIVE") -> tuple[int, int, int]:
+    # (busy, wal pages, pages checkpointed) as returned by wal_checkpoint
+    con = open_connection(db_path)
+    try:
+        row = con.execute(f"PRAGMA wal_checkpoint({mode})").fetchone()
+    finally:
+        con.close()
+    return int(row[0]), int(row[1]), int(row[2])
+
+
+def optimize(db_path: str) -> str:
+    # A plain PRAGMA optimize only looks at tables the same connection has
+    # queried, so on this fresh connection it would do nothing. 0x10002 makes
+    # it check every table (SQLite 3.46+); older versions get a bounded ANALYZE.
+    con = open_connection(db_path)
+    try:
+        if sqlite3.sqlite_version_info >= (3, 46, 0):
+            con.execute("PRAGMA optimize=0x10002")
+            return "optimize"
+        con.execute("PRAGMA analysis_limit=1000")
+        con.execute("ANALYZE")
+        return "analyze"
+    finally:
+        con.close()
@@ -0,0 +1,68 @@
+import asyncio
+import sqlite3
+import time
+from typing import Any, Optional
+
+from . import db as dbm
+
+
+class DbMaintenance:
+    # Background WAL checkpoints and planner-statistics refreshes (PRAGMA
+    # optimize, or ANALYZE before SQLite 3.46), run in a worker thread so
+    # that checkpoint I/O happens on a timer instead of on whichever handler's
+    # write crosses wal_autocheckpoint.
+    #
+    # PASSIVE checkpoints never wait on readers or writers; once the WAL file
+    # grows past truncate_above_bytes a TRUNCATE checkpoint resets it to zero.
+    #
+    # An idle anchor connection is held open while the bot runs: otherwise the
+    # close of each short-lived handler connection, being the last one open,
+    # checkpoints and deletes the WAL inline.
+
+    def __init__(self, db_path: str, truncate_above_bytes: int = 64 * 1024 * 1024):
+        self.db_path = db_path
+        self.truncate_above_bytes = truncate_above_bytes
+        self.stats: dict[str, Any] = {
+            "checkpoints": 0,
+            "truncates": 0,
+            "busy": 0,
+            "last_ms": 0.0,
+            "max_ms": 0.0,
+            "last_pages": 0,
+            "optimize_runs": 0,
+            "optimize_last_ms": 0.0,
+            "optimize_mode": "",
+        }
+        self._anchor: Optional[sqlite3.Connection] = None
+
+    def start(self) -> None:
+        if self._anchor is None:
+            self._anchor = dbm.open_connection(self.db_path)
+
+    def stop(self) -> None:
+        if self._anchor is not None:
+            self._anchor.close()
+            self._anchor = None
+
+    async def checkpoint(self, force_truncate: bool = False) -> tuple[int, int, int]:
+        mode = "TRUNCATE" if force_truncate or dbm.wal_size(self.db_path) > self.truncate_above_bytes else "PASSIVE"
+        t0 = time.perf_counter()
+        busy, log_pages, done = await asyncio.to_thread(dbm.checkpoint, self.db_path, mode)
+        ms = (time.perf_counter() - t0) * 1000
+        s = self.stats
+        s["checkpoints"] += 1
+        s["truncates"] += mode == "TRUNCATE"
+        s["busy"] += busy
+        s["last_ms"] = round(ms, 2)
+        s["max_ms"] = round(max(s["max_ms"], ms), 2)
+        s["last_pages"] = done
+        return busy, log_pages, done
+
+    async def optimize(self) -> None:
+        t0 = time.perf_counter()
+        self.stats["optimize_mode"] = await asyncio.to_thread(dbm.optimize, self.db_path)
+        self.stats["optimize_runs"] += 1
+        self.stats["optimize_last_ms"] = round((time.perf_counter() - t0) * 1000, 2)
+
+    def metrics(self) -> dict[str, Any]:
+        return {"wal_bytes": dbm.wal_size(self.db_path), **self.stats}
@@ -0,0 +1,248 @@
+import hashlib
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Optional
+
+from . import db as dbm
+
+_NON_WORD = re.compile(r"[\W_]+")
+_MEDIA_ATTRS = ("document", "audio", "video", "voice", "animation", "sticker", "video_note")
+MAX_TRACKED_USERS = 1000
+
+
+def normalize_text(text: str) -> str:
+    # NFKC folds look-alike forms (Arabic/Persian presentation forms, full-width
+    # digits); punctuation, emoji and whitespace runs are collapsed so trivial
+    # edits still hash the same.
+    t = unicodedata.normalize("NFKC", text).casefold()
+    return _NON_WORD.sub(" ", t).strip()
+
+
+def content_key(m, min_text_len: int = 16) -> Optional[tuple[str, str]]:
+    # (hash key, human preview) or None if the message is not worth tracking
+    if m.photo:
+        return "f:" + m.photo[-1].file_unique_id, f"[photo] {m.caption or ''}".strip()
+    for attr in _MEDIA_ATTRS:
+        media = getattr(m, attr, None)
+        if media is not None:
+            return "f:" + media.file_unique_id, f"[{attr}] {m.caption or ''}".strip()
+    if m.text:
+        norm = normalize_text(m.text)
+        if len(norm) < min_text_len:
+            return None
+        digest = hashlib.blake2b(norm.encode("utf-8"), digest_size=8).hexdigest()
+        return "t:" + digest, m.text
+    return None
+
+
+class _Entry:
+    __slots__ = ("first_ts", "last_ts", "count", "users", "suppressed", "pending", "preview")
+
+    def __init__(self, ts: float, preview: str):
+        self.first_ts = ts
+        self.last_ts = ts
+        self.count = 0
+        self.users: set[int] = set()
+        self.suppressed = 0
+        self.pending = 0  # suppressed since the last admin notice
+        self.preview = preview[:200]
+
+
+class FloodFilter:
+    # TTL hash table of recent content keys, ordered by last sighting. An entry
+    # lives while copies keep arriving within `window` seconds; the first
+    # `threshold` copies pass, the rest are suppressed and reported in batches
+    # through drain(). Memory is capped at max_keys entries (oldest dropped).
+
+    def __init__(self, window: int = 120, threshold: int = 3, min_text_len: int = 16, max_keys: int = 20000):
+        self.window = window
+        self.threshold = threshold
+        self.min_text_len = min_text_len
+        self.max_keys = max_keys
+        self.total_checked = 0
+        self.total_suppressed = 0
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._dirty: set[str] = set()
+        self._expired: list[tuple[str, _Entry]] = []  # evicted with unreported suppressions
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold > 0
+
+    def _expire(self, now: float) -> None:
+        while self._entries:
+            key, e = next(iter(self._entries.items()))
+            if now - e.last_ts < self.window and len(self._entries) < self.max_keys:
+                break
+            # keep it reachable until its pending count has been reported
+            if key in self._dirty:
+                self._expired.append((key, e))
+                self._dirty.discard(key)
+            del self._entries[key]
+
+    def check(self, m, user_id: int, now: Optional[float] = None) -> bool:
+        # True → let the message through, False → suppressed duplicate
+        if not self.enabled:
+            return True
+        ck = content_key(m, self.min_text_len)
+        if ck is None:
+            return True
+        key, preview = ck
+        now = now if now is not None else time.time()
+        self.total_checked += 1
+        self._expire(now)
+        e = self._entries.get(key)
+        if e is None:
+            e = self._entries[key] = _Entry(now, preview)
+        else:
+            self._entries.move_to_end(key)
+        e.last_ts = now
+        e.count += 1
+        if len(e.users) < MAX_TRACKED_USERS:
+            e.users.add(user_id)
+        if e.count <= self.threshold:
+            return True
+        e.suppressed += 1
+        e.pending += 1
+        self.total_suppressed += 1
+        self._dirty.add(key)
+        return False
+
+    def drain(self, now: Optional[float] = None) -> list[dict]:
+        # Collapsed notices for everything suppressed since the last drain
+        now = now if now is not None else time.time()
+        self._expire(now)
+        items = self._expired + [(k, self._entries[k]) for k in self._dirty]
+        self._expired = []
+        self._dirty = set()
+        out = []
+        for key, e in items:
+            out.append({
+                "key": key,
+                "suppressed": e.pending,
+                "total": e.count,
+                "users": len(e.users),
+                "preview": e.preview,
+                "since": e.first_ts,
+            })
+            e.pending = 0
+        return out
+
+    def metrics(self) -> dict:
+        return {"checked": self.total_checked, "suppressed": self.total_suppressed, "live_keys": len(self._entries)}
+
+    def top(self, n: int = 5) -> list[tuple[str, _Entry]]:
+        return sorted(((k, e) for k, e in self._entries.items() if e.suppressed), key=lambda kv: -kv[1].suppressed)[:n]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+
+class SharedFloodFilter:
+    # FloodFilter for shard workers: the counters live in the shared database
+    # (flood_keys / flood_users), so the threshold holds across all workers
+    # however users are spread over them. Only one worker should drain().
+    # total_checked / total_suppressed cover the keys that are still live.
+
+    def __init__(self, db_path: str, window: int = 120, threshold: int = 3, min_text_len: int = 16, max_keys: int = 20000):
+        self.db_path = db_path
+        self.window = window
+        self.threshold = threshold
+        self.min_text_len = min_text_len
+        self.max_keys = max_keys
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold > 0
+
+    def check(self, m, user_id: int, now: Optional[float] = None) -> bool:
+        if not self.enabled:
+            return True
+        ck = content_key(m, self.min_text_len)
+        if ck is None:
+            return True
+        key, preview = ck
+        now = now if now is not None else time.time()
+        with dbm.connect(self.db_path) as con:
+            # a lapsed entry starts over; its unreported suppressions stay pending
+            if dbm.execute(con, "UPDATE flood_keys SET first_ts=?, count=0, suppressed=0 WHERE key=? AND last_ts<=?", (now, key, now - self.window)):
+                dbm.execute(con, "DELETE FROM flood_users WHERE key=?", (key,))
+            count = con.execute(
+                """
+                INSERT INTO flood_keys(key, first_ts, last_ts, count, preview) VALUES (?, ?, ?, 1, ?)
+                ON CONFLICT(key) DO UPDATE SET
+                  last_ts=excluded.last_ts,
+                  count=count + 1,
+                  suppressed=suppressed + (count >= ?),
+                  pending=pending + (count >= ?)
+                RETURNING count
+                """,
+                (key, now, now, preview[:200], self.threshold, self.threshold),
+            ).fetchone()[0]
+            con.execute(
+                "INSERT OR IGNORE INTO flood_users(key, user_id) SELECT ?, ? WHERE (SELECT COUNT(*) FROM flood_users WHERE key=?) < ?",
+                (key, user_id, key, MAX_TRACKED_USERS),
+            )
+        return count <= self.threshold
+
+    def drain(self, now: Optional[float] = None) -> list[dict]:
+        now = now if now is not None else time.time()
+        with dbm.connect(self.db_path) as con:
+            rows = dbm.query(
+                con,
+                "SELECT key, first_ts, count, pending, preview, (SELECT COUNT(*) FROM flood_users u WHERE u.key=k.key) AS users "
+                "FROM flood_keys k WHERE pending > 0",
+            )
+            for r in rows:
+                # copies suppressed on other workers since the SELECT stay pending
+                dbm.execute(con, "UPDATE flood_keys SET pending=pending-? WHERE key=?", (r["pending"], r["key"]))
+            # reported entries past their window, then the oldest beyond max_keys
+            dbm.execute(con, "DELETE FROM flood_keys WHERE last_ts<=? AND pending=0", (now - self.window,))
+            dbm.execute(
+                con,
+                "DELETE FROM flood_keys WHERE pending=0 AND key IN (SELECT key FROM flood_keys ORDER BY last_ts DESC LIMIT -1 OFFSET ?)",
+                (self.max_keys,),
+            )
+            dbm.execute(con, "DELETE FROM flood_users WHERE key NOT IN (SELECT key FROM flood_keys)")
+        return [
+            {"key": r["key"], "suppressed": r["pending"], "total": r["count"], "users": r["users"], "preview": r["preview"], "since": r["first_ts"]}
+            for r in rows
+        ]
+
+    def _totals(self) -> tuple[int, int, int]:
+        with dbm.connect(self.db_path) as con:
+            row = con.execute("SELECT COUNT(*), COALESCE(SUM(count), 0), COALESCE(SUM(suppressed), 0) FROM flood_keys").fetchone()
+        return row[0], row[1], row[2]
+
+    @property
+    def total_checked(self) -> int:
+        return self._totals()[1]
+
+    @property
+    def total_suppressed(self) -> int:
+        return self._totals()[2]
+
+    def metrics(self) -> dict:
+        live, checked, suppressed = self._totals()
+        return {"checked": checked, "suppressed": suppressed, "live_keys": live}
+
+    def top(self, n: int = 5) -> list[tuple[str, _Entry]]:
+        with dbm.connect(self.db_path) as con:
+            rows = dbm.query(
+                con,
+                "SELECT key, first_ts, last_ts, count, suppressed, preview FROM flood_keys WHERE suppressed > 0 ORDER BY suppressed DESC LIMIT ?",
+                (n,),
+            )
+            out = []
+            for r in rows:
+                e = _Entry(r["first_ts"], r["preview"] or "")
+                e.last_ts, e.count, e.suppressed = r["last_ts"], r["count"], r["suppressed"]
+                e.users = {u["user_id"] for u in dbm.query(con, "SELECT user_id FROM flood_users WHERE key=?", (r["key"],))}
+                out.append((r["key"], e))
+        return out
+
+    def __len__(self) -> int:
+        return self._totals()[0]
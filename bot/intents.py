@@ -0,0 +1,47 @@
+import re
+from typing import Any, Iterable, Optional
+
+
+class Intents:
+    # Admin text commands ("reply 123", "بن 123 spam", "qr: ...") compiled
+    # into a single anchored alternation, so matching a text is one regex
+    # call no matter how many intents are registered.
+    #
+    # Each intent is a set of aliases (literal words in any language; a space
+    # in an alias matches any run of whitespace, including none) followed by
+    # an argument pattern whose groups are passed to the handler. Intents are
+    # tried in the order they were added.
+
+    def __init__(self, flags: int = re.IGNORECASE):
+        self.flags = flags
+        self._entries: list[tuple[str, str, Any]] = []
+        self._rx: Optional[re.Pattern] = None
+        self._slots: dict[int, tuple[Any, int, int]] = {}
+
+    def add(self, aliases: Iterable[str], args: str, handler: Any) -> None:
+        alt = "|".join(re.escape(a).replace(r"\ ", r"\s*") for a in aliases)
+        self._entries.append((alt, args, handler))
+        self._rx = None
+
+    def _compile(self) -> re.Pattern:
+        # Every intent is wrapped in its own group; when a branch matches,
+        # lastindex is that wrapper (it closes last), which locates both the
+        # handler and the slice of argument groups.
+        branches = []
+        self._slots = {}
+        index = 1
+        for alt, args, handler in self._entries:
+            n = re.compile(args).groups
+            branches.append(f"((?:{alt}){args})")
+            self._slots[index] = (handler, index + 1, index + 1 + n)
+            index += 1 + n
+        return re.compile("(?:" + "|".join(branches) + ")", self.flags)
+
+    def match(self, text: str) -> Optional[tuple[Any, tuple]]:
+        if self._rx is None:
+            self._rx = self._compile()
+        m = self._rx.fullmatch(text)
+        if m is None:
+            return None
+        handler, start, end = self._slots[m.lastindex]
+        return handler, m.groups()[start - 1 : end - 1]
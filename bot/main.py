@@ -5,20 +5,54 @@ import os
 import re
 import time
 from datetime import datetime, timezone
-from typing import Optional
+from typing import Any, Callable, Optional
 
 from telegram import Update, InputFile
 from telegram.constants import ParseMode
 from telegram.ext import (
+    Application,
     ApplicationBuilder,
     CommandHandler,
     MessageHandler,
+    TypeHandler,
     ContextTypes,
     filters,
 )
 
 from .config import load_config
 from . import db as dbm
+from . import outbox
+from .outbox import Outbox
+from .persistence import SQLitePersistence
+from .memory import MemoryGuard
+from .flood import FloodFilter, SharedFloodFilter
+from .transport import build_requests
+from .backup import Backups, latest_snapshot
+from .dbmaint import DbMaintenance
+from .assign import Assigner
+from .analytics import ResponseAnalytics, WINDOWS, KINDS
+from . import metrics
+from . import media
+from .intents import Intents
+from .shard import run_ingress
+
+
+# -------- Application --------
+class BotApplication(Application):
+    # Runtime services (config, outbox, assigner, ...) hang off the application
+    # instead of bot_data, which persistence deep-copies and saves every interval.
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.services: dict[str, Any] = {}
+        self.on_processed: Optional[Callable[[object], None]] = None  # shard workers ack updates here
+
+    async def process_update(self, update: object) -> None:
+        try:
+            await super().process_update(update)
+        finally:
+            # also after a failure, so a bad update is not replayed forever
+            if self.on_processed is not None:
+                self.on_processed(update)
 
 
 # -------- Access Control --------
@@ -27,13 +61,13 @@ def user_allowed(user_id: Optional[int], allowed: set[int]) -> bool:
 
 
 def is_admin(update: Update, context: ContextTypes.DEFAULT_TYPE) -> bool:
-    cfg = context.application.bot_data.get("config")
+    cfg = context.application.services.get("config")
     uid = update.effective_user.id if update.effective_user else None
-    return bool(cfg and uid == cfg.admin_id)
+    return bool(cfg and uid in cfg.admin_ids)
 
 
 async def guard(update: Update, context: ContextTypes.DEFAULT_TYPE) -> bool:
-    cfg = context.application.bot_data.get("config")
+    cfg = context.application.services.get("config")
     allowed: set[int] = cfg.allowed_user_ids if cfg else set()
     uid = update.effective_user.id if update.effective_user else None
     if not user_allowed(uid, allowed):
@@ -92,7 +126,7 @@ def ensure_data_dir(db_path: str) -> None:
 
 # -------- Command Handlers --------
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    cfg = context.application.bot_data["config"]
+    cfg = context.application.services["config"]
     if is_admin(update, context):
         msg = (
             "Admin panel ready.\n"
@@ -116,7 +150,7 @@ async def help_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 async def note_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     if not await guard_admin(update, context):
         return
-    cfg = context.application.bot_data["config"]
+    cfg = context.application.services["config"]
     text = " ".join(context.args) or (update.effective_message.reply_to_message.text if update.effective_message.reply_to_message and update.effective_message.reply_to_message.text else "")
     text = text.strip()
     if not text:
@@ -130,7 +164,7 @@ async def note_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 async def notes_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     if not await guard_admin(update, context):
         return
-    cfg = context.application.bot_data["config"]
+    cfg = context.application.services["config"]
     with dbm.connect(cfg.db_path) as con:
         rows = dbm.query(con, "SELECT id, text, created_at FROM notes WHERE user_id=? ORDER BY id DESC LIMIT 20", (update.effective_user.id,))
     if not rows:
@@ -147,7 +181,7 @@ async def delnote_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
         await update.effective_message.reply_text("Usage: /delnote <id>")
         return
     nid = int(context.args[0])
-    cfg = context.application.bot_data["config"]
+    cfg = context.application.services["config"]
     with dbm.connect(cfg.db_path) as con:
         n = dbm.execute(con, "DELETE FROM notes WHERE id=? AND user_id=?", (nid, update.effective_user.id))
     await update.effective_message.reply_text("Deleted." if n else "Not found or not yours.")
@@ -160,7 +194,7 @@ async def task_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     if not text:
         await update.effective_message.reply_text("Usage: /task <text>")
         return
-    cfg = context.application.bot_data["config"]
+    cfg = context.application.services["config"]
     with dbm.connect(cfg.db_path) as con:
         tid = dbm.insert(con, "INSERT INTO tasks(user_id, text) VALUES(?, ?)", (update.effective_user.id, text))
     await update.effective_message.reply_text(f"Added task #{tid}.")
@@ -169,7 +203,7 @@ async def task_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 async def tasks_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     if not await guard_admin(update, context):
         return
-    cfg = context.application.bot_data["config"]
+    cfg = context.application.services["config"]
     with dbm.connect(cfg.db_path) as con:
         rows = dbm.query(con, "SELECT id, text, done FROM tasks WHERE user_id=? ORDER BY done, id DESC LIMIT 50", (update.effective_user.id,))
     if not rows:
@@ -186,7 +220,7 @@ async def done_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         await update.effective_message.reply_text("Usage: /done <id>")
         return
     tid = int(context.args[0])
-    cfg = context.application.bot_data["config"]
+    cfg = context.application.services["config"]
     with dbm.connect(cfg.db_path) as con:
         n = dbm.execute(con, "UPDATE tasks SET done=1, done_at=CURRENT_TIMESTAMP WHERE id=? AND user_id=?", (tid, update.effective_user.id))
     await update.effective_message.reply_text("Done." if n else "Not found or not yours.")
@@ -199,7 +233,7 @@ async def deltask_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
         await update.effective_message.reply_text("Usage: /deltask <id>")
         return
     tid = int(context.args[0])
-    cfg = context.application.bot_data["config"]
+    cfg = context.application.services["config"]
     with dbm.connect(cfg.db_path) as con:
         n = dbm.execute(con, "DELETE FROM tasks WHERE id=? AND user_id=?", (tid, update.effective_user.id))
     await update.effective_message.reply_text("Deleted." if n else "Not found or not yours.")
@@ -217,7 +251,7 @@ async def remind_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
     if due <= now_ts():
         await update.effective_message.reply_text("Time is in the past.")
         return
-    cfg = context.application.bot_data["config"]
+    cfg = context.application.services["config"]
     with dbm.connect(cfg.db_path) as con:
         rid = dbm.insert(con, "INSERT INTO reminders(user_id, text, due_ts) VALUES(?, ?, ?)", (update.effective_user.id, text, due))
 
@@ -231,7 +265,7 @@ async def remind_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
 async def reminders_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     if not await guard_admin(update, context):
         return
-    cfg = context.application.bot_data["config"]
+    cfg = context.application.services["config"]
     with dbm.connect(cfg.db_path) as con:
         rows = dbm.query(con, "SELECT id, text, due_ts, status FROM reminders WHERE user_id=? AND status='active' ORDER BY due_ts ASC", (update.effective_user.id,))
     if not rows:
@@ -248,7 +282,7 @@ async def delrem_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
         await update.effective_message.reply_text("Usage: /delrem <id>")
         return
     rid = int(context.args[0])
-    cfg = context.application.bot_data["config"]
+    cfg = context.application.services["config"]
     # try cancel job
     for job in context.job_queue.get_jobs_by_name(f"rem-{rid}"):
         job.schedule_removal()
@@ -261,7 +295,7 @@ async def reminder_fire(context: ContextTypes.DEFAULT_TYPE) -> None:
     data = context.job.data or {}
     rid = data.get("rid")
     uid = data.get("uid")
-    cfg = context.application.bot_data["config"]
+    cfg = context.application.services["config"]
     text = None
     with dbm.connect(cfg.db_path) as con:
         rows = dbm.query(con, "SELECT text FROM reminders WHERE id=? AND user_id=? AND status='active'", (rid, uid))
@@ -279,7 +313,7 @@ async def search_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
     if not q:
         await update.effective_message.reply_text("Usage: /search <query>")
         return
-    cfg = context.application.bot_data["config"]
+    cfg = context.application.services["config"]
     like = f"%{q}%"
     with dbm.connect(cfg.db_path) as con:
         notes = dbm.query(con, "SELECT 'note' AS src, id, text, created_at FROM notes WHERE user_id=? AND text LIKE ? ORDER BY id DESC LIMIT 10", (update.effective_user.id, like))
@@ -300,7 +334,7 @@ async def export_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
         await update.effective_message.reply_text("Usage: /export notes|tasks")
         return
     what = context.args[0]
-    cfg = context.application.bot_data["config"]
+    cfg = context.application.services["config"]
     with dbm.connect(cfg.db_path) as con:
         if what == "notes":
             rows = dbm.query(con, "SELECT id, text, created_at FROM notes WHERE user_id=? ORDER BY id", (update.effective_user.id,))
@@ -315,7 +349,7 @@ async def export_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
 async def files_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     if not await guard_admin(update, context):
         return
-    cfg = context.application.bot_data["config"]
+    cfg = context.application.services["config"]
     with dbm.connect(cfg.db_path) as con:
         rows = dbm.query(con, "SELECT id, kind, created_at, caption FROM files WHERE user_id=? ORDER BY id DESC LIMIT 20", (update.effective_user.id,))
     if not rows:
@@ -332,25 +366,18 @@ async def getfile_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
         await update.effective_message.reply_text("Usage: /getfile <id>")
         return
     fid = int(context.args[0])
-    cfg = context.application.bot_data["config"]
+    cfg = context.application.services["config"]
     with dbm.connect(cfg.db_path) as con:
         rows = dbm.query(con, "SELECT id, file_id, kind, caption FROM files WHERE id=? AND user_id=?", (fid, update.effective_user.id))
     if not rows:
         await update.effective_message.reply_text("Not found or not yours.")
         return
     row = rows[0]
-    if row["kind"] == "photo":
-        await update.effective_message.reply_photo(row["file_id"], caption=row["caption"] or None)
-    elif row["kind"] == "document":
-        await update.effective_message.reply_document(row["file_id"], caption=row["caption"] or None)
-    elif row["kind"] == "audio":
-        await update.effective_message.reply_audio(row["file_id"], caption=row["caption"] or None)
-    elif row["kind"] == "video":
-        await update.effective_message.reply_video(row["file_id"], caption=row["caption"] or None)
-    elif row["kind"] == "voice":
-        await update.effective_message.reply_voice(row["file_id"], caption=row["caption"] or None)
-    else:
+    if row["kind"] not in media.SEND:
         await update.effective_message.reply_text("Unsupported file type.")
+        return
+    method, kwargs = media.send_args(row["kind"], row["file_id"], row["caption"] or None)
+    await getattr(context.bot, method)(chat_id=update.effective_chat.id, **kwargs)
 
 
 # -------- Message handlers --------
@@ -358,7 +385,7 @@ async def text_logger(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
     # Admin-only logger; not used for routing inbound user messages
     if not await guard_admin(update, context):
         return
-    cfg = context.application.bot_data["config"]
+    cfg = context.application.services["config"]
     txt = update.effective_message.text
     if not txt:
         return
@@ -371,44 +398,28 @@ async def file_saver(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
     if not await guard_admin(update, context):
         return
     m = update.effective_message
-    cfg = context.application.bot_data["config"]
-    kind = None
-    file_id = None
-    unique_id = None
-    caption = m.caption if m.caption else None
-
-    if m.document:
-        kind = "document"
-        file_id = m.document.file_id
-        unique_id = m.document.file_unique_id
-    elif m.photo:
-        kind = "photo"
-        ph = m.photo[-1]
-        file_id = ph.file_id
-        unique_id = ph.file_unique_id
-    elif m.audio:
-        kind = "audio"
-        file_id = m.audio.file_id
-        unique_id = m.audio.file_unique_id
-    elif m.video:
-        kind = "video"
-        file_id = m.video.file_id
-        unique_id = m.video.file_unique_id
-    elif m.voice:
-        kind = "voice"
-        file_id = m.voice.file_id
-        unique_id = m.voice.file_unique_id
-
-    if kind and file_id:
+    cfg = context.application.services["config"]
+    md = media.extract(m)
+    if md:
+        kind, file_id, unique_id = md
         with dbm.connect(cfg.db_path) as con:
             fid = dbm.insert(
                 con,
                 "INSERT INTO files(user_id, file_id, unique_id, kind, caption) VALUES(?, ?, ?, ?, ?)",
-                (update.effective_user.id, file_id, unique_id, kind, caption),
+                (update.effective_user.id, file_id, unique_id, kind, m.caption or None),
             )
         await m.reply_text(f"Saved file #{fid} ({kind}). Use /getfile {fid}")
 
 
+async def track_activity(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    # Runs before every other handler (group -1); feeds the idle/LRU eviction
+    # and the admin idle detection used for conversation reassignment
+    if update.effective_user:
+        context.application.services["memory"].touch(update.effective_user.id)
+        if is_admin(update, context):
+            context.application.services["assigner"].touch_admin(update.effective_user.id)
+
+
 # -------- Messenger routing --------
 from telegram import ReplyKeyboardMarkup, KeyboardButton
 
@@ -465,151 +476,144 @@ async def inbound_user_message(update: Update, context: ContextTypes.DEFAULT_TYP
     if last and (now - last) < 3:
         return
     context.application.bot_data[rl_key] = now
-    cfg = context.application.bot_data["config"]
+    cfg = context.application.services["config"]
     m = update.effective_message
+
+    # Bans and the duplicate-content filter are checked before any write, so
+    # dropped messages never take the write lock. Banned users never count
+    # towards a wave; admins get a collapsed "N similar messages" notice from
+    # flood_notice_job instead of the copies.
     with dbm.connect(cfg.db_path) as con:
-        upsert_user(con, u)
         banned = is_banned(con, u.id)
-        if banned:
-            # silently ignore or inform? We'll ignore to avoid spam
-            return
+    if banned:
+        # silently ignore or inform? We'll ignore to avoid spam
+        return
+    if not context.application.services["flood"].check(m, u.id):
+        return
+
+    # Build header
+    name = (u.first_name or "") + (f" {u.last_name}" if u.last_name else "")
+    uname = f"@{u.username}" if u.username else ""
+    header = f"From: {name} {uname}\nID: {u.id}"
+    kb = admin_reply_keyboard_for(u.id).to_dict()
+
+    with dbm.connect(cfg.db_path) as con:
+        upsert_user(con, u)
+        admin_id = context.application.services["assigner"].admin_for(con, u.id)
         # Save text part for search
         if m.text:
             dbm.insert(con, "INSERT INTO messages(user_id, text) VALUES(?, ?)", (u.id, m.text))
         # Save incoming file metadata (optional)
-        kind = None
-        file_id = None
-        unique_id = None
+        md = media.extract(m)
         caption = m.caption if m.caption else None
-        if m.document:
-            kind = "document"; file_id = m.document.file_id; unique_id = m.document.file_unique_id
-        elif m.photo:
-            ph = m.photo[-1]; kind = "photo"; file_id = ph.file_id; unique_id = ph.file_unique_id
-        elif m.audio:
-            kind = "audio"; file_id = m.audio.file_id; unique_id = m.audio.file_unique_id
-        elif m.video:
-            kind = "video"; file_id = m.video.file_id; unique_id = m.video.file_unique_id
-        elif m.voice:
-            kind = "voice"; file_id = m.voice.file_id; unique_id = m.voice.file_unique_id
-        if kind and file_id:
-            dbm.insert(con, "INSERT INTO files(user_id, file_id, unique_id, kind, caption) VALUES(?, ?, ?, ?, ?)", (u.id, file_id, unique_id, kind, caption))
+        if md:
+            dbm.insert(con, "INSERT INTO files(user_id, file_id, unique_id, kind, caption) VALUES(?, ?, ?, ?, ?)", (u.id, md[1], md[2], md[0], caption))
 
-    # Build header
-    name = (u.first_name or "") + (f" {u.last_name}" if u.last_name else "")
-    uname = f"@{u.username}" if u.username else ""
-    header = f"From: {name} {uname}\nID: {u.id}"
+        # Queue delivery to admin in the same commit; the outbox workers send it
+        # and write the relays row.
+        method = None
+        if m.text:
+            method, kwargs = "send_message", {"text": f"{header}\n\n{m.text}", "reply_markup": kb}
+        elif md:
+            method, kwargs = media.send_args(md[0], md[1], f"{header}\n\n{caption or ''}")
+        if method:
+            outbox.enqueue(
+                con,
+                admin_id,
+                method,
+                kwargs,
+                dedup_key=f"in:{m.chat_id}:{m.message_id}",
+                relay=(u.id, "to_admin", m.message_id, admin_id),
+                followups=[
+                    # ensure keyboard is shown/updated for admin chat
+                    {"chat_id": admin_id, "text": "اختیارات: Reply / Ban / Unban / Who / Cancel", "reply_markup": kb},
+                    {"chat_id": m.chat_id, "text": "پیام شما برای مدیر ارسال شد ✅"},
+                ],
+            )
+    context.application.services["outbox"].notify()
 
-    # Send to admin
-    kb = admin_reply_keyboard_for(u.id)
-    sent = None
-    if m.text:
-        sent = await context.bot.send_message(chat_id=cfg.admin_id, text=f"{header}\n\n{m.text}", reply_markup=kb)
-    elif m.photo:
-        sent = await context.bot.send_photo(chat_id=cfg.admin_id, photo=m.photo[-1].file_id, caption=f"{header}\n\n{caption or ''}")
-    elif m.document:
-        sent = await context.bot.send_document(chat_id=cfg.admin_id, document=m.document.file_id, caption=f"{header}\n\n{caption or ''}")
-    elif m.audio:
-        sent = await context.bot.send_audio(chat_id=cfg.admin_id, audio=m.audio.file_id, caption=f"{header}\n\n{caption or ''}")
-    elif m.video:
-        sent = await context.bot.send_video(chat_id=cfg.admin_id, video=m.video.file_id, caption=f"{header}\n\n{caption or ''}")
-    elif m.voice:
-        sent = await context.bot.send_voice(chat_id=cfg.admin_id, voice=m.voice.file_id, caption=f"{header}\n\n{caption or ''}")
-    # ensure keyboard is shown/updated for admin chat
-    try:
-        await context.bot.send_message(chat_id=cfg.admin_id, text="اختیارات: Reply / Ban / Unban / Who / Cancel", reply_markup=kb)
-    except Exception:
-        pass
-    if sent:
-        with dbm.connect(cfg.db_path) as con:
-            dbm.insert(con, "INSERT INTO relays(user_id, direction, admin_msg_id, peer_msg_id) VALUES(?, 'to_admin', ?, ?)", (u.id, sent.message_id, m.message_id))
-        try:
-            await m.reply_text("پیام شما برای مدیر ارسال شد ✅")
-        except Exception:
-            pass
 
+async def _reply_intent(update: Update, context: ContextTypes.DEFAULT_TYPE, uid: str) -> None:
+    context.user_data["reply_to_uid"] = int(uid)
+    await update.effective_message.reply_text(f"حالت پاسخ فعال شد → {uid}. پیام بعدی شما برای او ارسال می‌شود. برای لغو: Cancel")
 
-async def admin_text_buttons_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    if not is_admin(update, context):
-        return
-    text = (update.effective_message.text or "").strip()
-    # Persian/English patterns
-    # Reply flow
-    m1 = re.match(r"^(reply|پاسخ)\s+(\d+)$", text, flags=re.IGNORECASE)
-    if m1:
-        uid = int(m1.group(2))
-        context.user_data["reply_to_uid"] = uid
-        await update.effective_message.reply_text(f"حالت پاسخ فعال شد → {uid}. پیام بعدی شما برای او ارسال می‌شود. برای لغو: Cancel")
-        return
-
-    # Ban
-    m2 = re.match(r"^(ban|بن)\s+(\d+)(?:\s+(.+))?$", text, flags=re.IGNORECASE)
-    if m2:
-        uid = int(m2.group(2))
-        reason = (m2.group(3) or "").strip()
-        with dbm.connect(context.application.bot_data["config"].db_path) as con:
-            dbm.execute(con, "INSERT INTO bans(user_id, reason, active, updated_at) VALUES(?, ?, 1, CURRENT_TIMESTAMP) ON CONFLICT(user_id) DO UPDATE SET reason=excluded.reason, active=1, updated_at=CURRENT_TIMESTAMP", (uid, reason))
-        await update.effective_message.reply_text(f"کاربر {uid} بن شد.")
-        return
-
-    # Unban
-    m3 = re.match(r"^(unban|رفع\s*بن|آنبن)\s+(\d+)$", text, flags=re.IGNORECASE)
-    if m3:
-        uid = int(m3.group(2))
-        with dbm.connect(context.application.bot_data["config"].db_path) as con:
-            dbm.execute(con, "UPDATE bans SET active=0, updated_at=CURRENT_TIMESTAMP WHERE user_id=?", (uid,))
-        await update.effective_message.reply_text(f"کاربر {uid} آزاد شد.")
-        return
-
-    # Who
-    m4 = re.match(r"^(who|کی|اطلاعات)\s+(\d+)$", text, flags=re.IGNORECASE)
-    if m4:
-        uid = int(m4.group(2))
-        with dbm.connect(context.application.bot_data["config"].db_path) as con:
-            rows = dbm.query(con, "SELECT * FROM users WHERE user_id=?", (uid,))
-            banned = is_banned(con, uid)
-        if not rows:
-            await update.effective_message.reply_text("Unknown user.")
-        else:
-            r = rows[0]
-            info = f"ID: {r['user_id']}\nName: {r['first_name']} {r['last_name']}\nUsername: @{r['username']}\nLang: {r['language_code']}\nBanned: {banned}"
-            await update.effective_message.reply_text(info)
-        return
 
-    # Stats
-    if re.match(r"^(stats|آمار)$", text, flags=re.IGNORECASE):
-        await stats_cmd(update, context)
-        return
+async def _ban_intent(update: Update, context: ContextTypes.DEFAULT_TYPE, uid: str, reason: Optional[str]) -> None:
+    with dbm.connect(context.application.services["config"].db_path) as con:
+        dbm.execute(con, "INSERT INTO bans(user_id, reason, active, updated_at) VALUES(?, ?, 1, CURRENT_TIMESTAMP) ON CONFLICT(user_id) DO UPDATE SET reason=excluded.reason, active=1, updated_at=CURRENT_TIMESTAMP", (int(uid), (reason or "").strip()))
+    await update.effective_message.reply_text(f"کاربر {uid} بن شد.")
 
-    # Cancel
-    if re.match(r"^(cancel|لغو)$", text, flags=re.IGNORECASE):
-        context.user_data.pop("reply_to_uid", None)
-        await update.effective_message.reply_text("حالت پاسخ غیرفعال شد.")
+
+async def _unban_intent(update: Update, context: ContextTypes.DEFAULT_TYPE, uid: str) -> None:
+    with dbm.connect(context.application.services["config"].db_path) as con:
+        dbm.execute(con, "UPDATE bans SET active=0, updated_at=CURRENT_TIMESTAMP WHERE user_id=?", (int(uid),))
+    await update.effective_message.reply_text(f"کاربر {uid} آزاد شد.")
+
+
+async def _who_intent(update: Update, context: ContextTypes.DEFAULT_TYPE, uid: str) -> None:
+    with dbm.connect(context.application.services["config"].db_path) as con:
+        rows = dbm.query(con, "SELECT * FROM users WHERE user_id=?", (int(uid),))
+        banned = is_banned(con, int(uid))
+    if not rows:
+        await update.effective_message.reply_text("Unknown user.")
+    else:
+        r = rows[0]
+        info = f"ID: {r['user_id']}\nName: {r['first_name']} {r['last_name']}\nUsername: @{r['username']}\nLang: {r['language_code']}\nBanned: {banned}"
+        await update.effective_message.reply_text(info)
+
+
+async def _stats_intent(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    await stats_cmd(update, context)
+
+
+async def _cancel_intent(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    context.user_data.pop("reply_to_uid", None)
+    await update.effective_message.reply_text("حالت پاسخ غیرفعال شد.")
+
+
+async def _quick_reply_intent(update: Update, context: ContextTypes.DEFAULT_TYPE, payload: str) -> None:
+    target = context.user_data.get("reply_to_uid")
+    if not target:
+        await update.effective_message.reply_text("ابتدا با دکمه Reply <id> هدف را انتخاب کنید.")
         return
+    m = update.effective_message
+    with dbm.connect(context.application.services["config"].db_path) as con:
+        context.application.services["assigner"].claim(con, target, m.chat_id)
+        outbox.enqueue(con, target, "send_message", {"text": payload.strip()}, dedup_key=f"out:{m.chat_id}:{m.message_id}", relay=(target, "to_user", m.message_id, m.chat_id), followups=[{"chat_id": m.chat_id, "text": "ارسال شد ✅"}])
+    context.application.services["outbox"].notify()
 
-    # Quick reply buttons
-    mqr = re.match(r"^(qr:|پاسخ\s*سریع:)\s*(.+)$", text, flags=re.IGNORECASE)
-    if mqr:
-        target = context.user_data.get("reply_to_uid")
-        if not target:
-            await update.effective_message.reply_text("ابتدا با دکمه Reply <id> هدف را انتخاب کنید.")
-            return
-        payload = mqr.group(2).strip()
-        sent = await context.bot.send_message(chat_id=target, text=payload)
-        with dbm.connect(context.application.bot_data["config"].db_path) as con:
-            dbm.insert(con, "INSERT INTO relays(user_id, direction, admin_msg_id, peer_msg_id) VALUES(?, 'to_user', ?, ?)", (target, update.effective_message.message_id, sent.message_id))
-        await update.effective_message.reply_text("ارسال شد ✅")
+
+# Admin keyboard / typed commands, Persian and English. New commands are one
+# add() here: aliases, argument pattern (its groups become handler arguments), handler.
+ADMIN_INTENTS = Intents()
+ADMIN_INTENTS.add(("reply", "پاسخ"), r"\s+(\d+)", _reply_intent)
+ADMIN_INTENTS.add(("ban", "بن"), r"\s+(\d+)(?:\s+(.+))?", _ban_intent)
+ADMIN_INTENTS.add(("unban", "رفع بن", "آنبن"), r"\s+(\d+)", _unban_intent)
+ADMIN_INTENTS.add(("who", "کی", "اطلاعات"), r"\s+(\d+)", _who_intent)
+ADMIN_INTENTS.add(("stats", "آمار"), "", _stats_intent)
+ADMIN_INTENTS.add(("cancel", "لغو"), "", _cancel_intent)
+ADMIN_INTENTS.add(("qr:", "پاسخ سریع:"), r"\s*(.+)", _quick_reply_intent)
+
+
+async def admin_text_buttons_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not is_admin(update, context):
+        return
+    text = (update.effective_message.text or "").strip()
+    hit = ADMIN_INTENTS.match(text)
+    if hit:
+        handler, args = hit
+        await handler(update, context, *args)
         return
 
     # If in reply mode, route this message to target user
     target = context.user_data.get("reply_to_uid")
     if target:
-        # send to target
+        # queue for target; the relay is logged once delivered
         m = update.effective_message
-        sent = await context.bot.send_message(chat_id=target, text=m.text)
-        # log relay
-        with dbm.connect(context.application.bot_data["config"].db_path) as con:
-            dbm.insert(con, "INSERT INTO relays(user_id, direction, admin_msg_id, peer_msg_id) VALUES(?, 'to_user', ?, ?)", (target, m.message_id, sent.message_id))
-        await update.effective_message.reply_text("ارسال شد ✅")
+        with dbm.connect(context.application.services["config"].db_path) as con:
+            context.application.services["assigner"].claim(con, target, m.chat_id)
+            outbox.enqueue(con, target, "send_message", {"text": m.text}, dedup_key=f"out:{m.chat_id}:{m.message_id}", relay=(target, "to_user", m.message_id, m.chat_id), followups=[{"chat_id": m.chat_id, "text": "ارسال شد ✅"}])
+        context.application.services["outbox"].notify()
         context.user_data.pop("reply_to_uid", None)
         return
 
@@ -618,33 +622,33 @@ async def admin_reply_router(update: Update, context: ContextTypes.DEFAULT_TYPE)
     # Admin replies to a relay → send to that user
     if not is_admin(update, context):
         return
-    cfg = context.application.bot_data["config"]
+    cfg = context.application.services["config"]
     m = update.effective_message
     if not m.reply_to_message:
         return
     parent_id = m.reply_to_message.message_id
-    # lookup mapping
+    # lookup mapping; message ids are per chat, so match this admin's chat
+    # (NULL admin_id = relayed before multi-admin, i.e. to the primary admin)
     with dbm.connect(cfg.db_path) as con:
-        rows = dbm.query(con, "SELECT user_id FROM relays WHERE direction='to_admin' AND admin_msg_id=? ORDER BY id DESC LIMIT 1", (parent_id,))
+        rows = dbm.query(
+            con,
+            "SELECT user_id FROM relays WHERE direction='to_admin' AND admin_msg_id=? AND COALESCE(admin_id, ?)=? ORDER BY id DESC LIMIT 1",
+            (parent_id, cfg.admin_id, m.chat_id),
+        )
     if not rows:
         return
     uid = rows[0]["user_id"]
-    sent = None
+    md = media.extract(m)
+    method = None
     if m.text:
-        sent = await context.bot.send_message(chat_id=uid, text=m.text)
-    elif m.photo:
-        sent = await context.bot.send_photo(chat_id=uid, photo=m.photo[-1].file_id, caption=m.caption or None)
-    elif m.document:
-        sent = await context.bot.send_document(chat_id=uid, document=m.document.file_id, caption=m.caption or None)
-    elif m.audio:
-        sent = await context.bot.send_audio(chat_id=uid, audio=m.audio.file_id, caption=m.caption or None)
-    elif m.video:
-        sent = await context.bot.send_video(chat_id=uid, video=m.video.file_id, caption=m.caption or None)
-    elif m.voice:
-        sent = await context.bot.send_voice(chat_id=uid, voice=m.voice.file_id, caption=m.caption or None)
-    if sent:
+        method, kwargs = "send_message", {"text": m.text}
+    elif md:
+        method, kwargs = media.send_args(md[0], md[1], m.caption or None)
+    if method:
         with dbm.connect(cfg.db_path) as con:
-            dbm.insert(con, "INSERT INTO relays(user_id, direction, admin_msg_id, peer_msg_id) VALUES(?, 'to_user', ?, ?)", (uid, parent_id, sent.message_id))
+            context.application.services["assigner"].claim(con, uid, m.chat_id)
+            outbox.enqueue(con, uid, method, kwargs, dedup_key=f"out:{m.chat_id}:{m.message_id}", relay=(uid, "to_user", parent_id, m.chat_id))
+        context.application.services["outbox"].notify()
 
 
 async def ban_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -655,7 +659,7 @@ async def ban_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         return
     uid = int(context.args[0])
     reason = " ".join(context.args[1:]).strip()
-    cfg = context.application.bot_data["config"]
+    cfg = context.application.services["config"]
     with dbm.connect(cfg.db_path) as con:
         dbm.execute(con, "INSERT INTO bans(user_id, reason, active, updated_at) VALUES(?, ?, 1, CURRENT_TIMESTAMP) ON CONFLICT(user_id) DO UPDATE SET reason=excluded.reason, active=1, updated_at=CURRENT_TIMESTAMP", (uid, reason))
     await update.effective_message.reply_text(f"User {uid} banned.")
@@ -668,7 +672,7 @@ async def unban_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         await update.effective_message.reply_text("Usage: /unban <user_id>")
         return
     uid = int(context.args[0])
-    with dbm.connect(context.application.bot_data["config"].db_path) as con:
+    with dbm.connect(context.application.services["config"].db_path) as con:
         dbm.execute(con, "UPDATE bans SET active=0, updated_at=CURRENT_TIMESTAMP WHERE user_id=?", (uid,))
     await update.effective_message.reply_text(f"User {uid} unbanned.")
 
@@ -680,7 +684,7 @@ async def who_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         await update.effective_message.reply_text("Usage: /who <user_id>")
         return
     uid = int(context.args[0])
-    with dbm.connect(context.application.bot_data["config"].db_path) as con:
+    with dbm.connect(context.application.services["config"].db_path) as con:
         rows = dbm.query(con, "SELECT * FROM users WHERE user_id=?", (uid,))
         banned = is_banned(con, uid)
     if not rows:
@@ -694,16 +698,243 @@ async def who_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 async def stats_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     if not await guard_admin(update, context):
         return
-    with dbm.connect(context.application.bot_data["config"].db_path) as con:
+    with dbm.connect(context.application.services["config"].db_path) as con:
         users = dbm.query(con, "SELECT COUNT(*) AS c FROM users")[0]["c"]
         banned = dbm.query(con, "SELECT COUNT(*) AS c FROM bans WHERE active=1")[0]["c"]
         msgs = dbm.query(con, "SELECT COUNT(*) AS c FROM messages")[0]["c"]
     await update.effective_message.reply_text(f"Users: {users}\nBanned: {banned}\nMessages: {msgs}")
 
 
+async def outbox_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not await guard_admin(update, context):
+        return
+    cfg = context.application.services["config"]
+    ob = context.application.services["outbox"]
+    if context.args and context.args[0] == "retry":
+        with dbm.connect(cfg.db_path) as con:
+            n = outbox.requeue_dead(con)
+        ob.notify()
+        await update.effective_message.reply_text(f"Requeued {n} dead message(s).")
+        return
+    with dbm.connect(cfg.db_path) as con:
+        c = outbox.counts(con)
+        dead = dbm.query(con, "SELECT id, chat_id, attempts, last_error FROM outbox WHERE status='dead' ORDER BY id DESC LIMIT 5")
+    lines = [
+        f"Pending: {c.get('pending', 0)}  Sending: {c.get('sending', 0)}  Sent: {c.get('sent', 0)}  Dead: {c.get('dead', 0)}",
+        f"Since start — sent: {ob.stats['sent']}, retried: {ob.stats['retried']}, dead: {ob.stats['dead']}",
+    ]
+    lines += [f"#{r['id']} → {r['chat_id']} ({r['attempts']}x): {r['last_error']}" for r in dead]
+    if dead:
+        lines.append("Use /outbox retry to requeue dead messages.")
+    await update.effective_message.reply_text("\n".join(lines))
+
+
+async def mem_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not await guard_admin(update, context):
+        return
+    mg = context.application.services["memory"]
+    if context.args and context.args[0] == "sweep":
+        n = mg.sweep(context.application)
+        await update.effective_message.reply_text(f"Evicted {n} user(s).")
+        return
+    rep = mg.report(context.application)
+    lines = [f"{name}: {n} entries, ~{size / 1024:.1f} KiB" for name, (n, size) in rep.items()]
+    lines.append(f"Total: ~{sum(size for _, size in rep.values()) / 1024:.1f} KiB")
+    lines.append(f"Evicted — idle: {mg.evicted['idle']}, lru: {mg.evicted['lru']}, budget: {mg.evicted['budget']}")
+    budget = f"{mg.budget_bytes // (1024 * 1024)} MiB" if mg.budget_bytes else "off"
+    lines.append(f"Limits — idle TTL: {mg.idle_ttl}s, max users: {mg.max_users}, budget: {budget}")
+    await update.effective_message.reply_text("\n".join(lines))
+
+
+async def flood_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not await guard_admin(update, context):
+        return
+    fl = context.application.services["flood"]
+    if not fl.enabled:
+        await update.effective_message.reply_text("Flood filter disabled (FLOOD_THRESHOLD=0).")
+        return
+    lines = [
+        f"Checked: {fl.total_checked}  Suppressed: {fl.total_suppressed}  Live keys: {len(fl)}",
+        f"Window: {fl.window}s, threshold: {fl.threshold} copies",
+    ]
+    for _, e in fl.top():
+        lines.append(f"• {e.suppressed} suppressed / {e.count} seen from {len(e.users)} user(s): {e.preview[:80]}")
+    await update.effective_message.reply_text("\n".join(lines))
+
+
+async def metrics_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not await guard_admin(update, context):
+        return
+    await update.effective_message.reply_text(metrics.render(metrics.collect(context.application)) or "No metrics.")
+
+
+async def net_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not await guard_admin(update, context):
+        return
+    snap = metrics.collect(context.application)
+    lines = []
+    for name in ("net.send", "net.updates"):
+        m = snap.get(name, {})
+        lines.append(
+            f"{name}: {m.get('in_flight')}/{m.get('pool_size')} busy (peak {m.get('peak_in_flight')}), "
+            f"{m.get('requests')} req, waited {m.get('waited')}x avg {m.get('wait_avg_ms')} ms max {m.get('wait_max_ms')} ms, "
+            f"pool timeouts {m.get('pool_timeouts')}"
+        )
+    await update.effective_message.reply_text("\n".join(lines))
+
+
+async def backup_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not await guard_admin(update, context):
+        return
+    bk = context.application.services["backups"]
+    path = latest_snapshot(bk.backup_dir)
+    if (context.args and context.args[0] == "now") or not path:
+        await update.effective_message.reply_text("Creating snapshot...")
+        try:
+            path = await bk.run()
+        except Exception as e:
+            await update.effective_message.reply_text(f"Backup failed: {e}")
+            return
+    size = os.path.getsize(path)
+    if size > 50 * 1024 * 1024:
+        # Bot API upload limit (unless using a local Bot API server)
+        await update.effective_message.reply_text(f"Latest snapshot is {size / 1048576:.1f} MiB, too large to send: {path}")
+        return
+    with open(path, "rb") as f:
+        await update.effective_message.reply_document(f, filename=os.path.basename(path), caption=f"{os.path.basename(path)} ({size / 1024:.0f} KiB, integrity ok)")
+
+
+async def db_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not await guard_admin(update, context):
+        return
+    mt = context.application.services["dbmaint"]
+    if context.args and context.args[0] == "checkpoint":
+        busy, log_pages, done = await mt.checkpoint(force_truncate=True)
+        await update.effective_message.reply_text(f"Checkpoint: {done}/{log_pages} pages, busy={busy}.")
+        return
+    m = mt.metrics()
+    await update.effective_message.reply_text(
+        f"WAL: {m['wal_bytes'] / 1024:.0f} KiB\n"
+        f"Checkpoints: {m['checkpoints']} (truncate {m['truncates']}, busy {m['busy']}), last {m['last_ms']} ms, max {m['max_ms']} ms\n"
+        f"Optimize: {m['optimize_runs']} run(s){' (' + m['optimize_mode'] + ')' if m['optimize_mode'] else ''}, last {m['optimize_last_ms']} ms"
+    )
+
+
+async def admins_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not await guard_admin(update, context):
+        return
+    lines = []
+    for r in context.application.services["assigner"].report():
+        state = "available" if r["available"] else f"idle {r['idle_s'] // 60}m"
+        lines.append(f"{r['admin_id']}: {r['open']} open — {state}")
+    await update.effective_message.reply_text("\n".join(lines))
+
+
+async def assign_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not await guard_admin(update, context):
+        return
+    cfg = context.application.services["config"]
+    if len(context.args) != 2 or not all(a.isdigit() for a in context.args) or int(context.args[1]) not in cfg.admin_ids:
+        await update.effective_message.reply_text("Usage: /assign <user_id> <admin_id>")
+        return
+    uid, admin_id = int(context.args[0]), int(context.args[1])
+    with dbm.connect(cfg.db_path) as con:
+        context.application.services["assigner"].reassign(con, uid, admin_id)
+        outbox.enqueue(con, admin_id, "send_message", {"text": f"↪️ Conversation with {uid} assigned to you.", "reply_markup": admin_reply_keyboard_for(uid).to_dict()}, dedup_key=f"assign:{uid}:{admin_id}:{now_ts()}")
+    context.application.services["outbox"].notify()
+    await update.effective_message.reply_text(f"User {uid} → admin {admin_id}.")
+
+
+def _dur(seconds: float) -> str:
+    seconds = int(seconds)
+    if seconds < 120:
+        return f"{seconds}s"
+    if seconds < 7200:
+        return f"{seconds // 60}m"
+    return f"{seconds / 3600:.1f}h"
+
+
+async def sla_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not await guard_admin(update, context):
+        return
+    an = context.application.services["analytics"]
+    an.refresh()
+    o = an.open_stats()
+    lines = [f"Open conversations: {o['open']} ({o['awaiting']} awaiting first reply, oldest {_dur(o['oldest_wait_s'])})"]
+    for kind, title in zip(KINDS, ("First response", "Resolution")):
+        lines.append(f"\n{title} (p50 / p90 / p99):")
+        for wname, secs in WINDOWS.items():
+            st = an.window_stats(kind, secs)
+            if st["n"]:
+                lines.append(f"  {wname}: {_dur(st['p50'])} / {_dur(st['p90'])} / {_dur(st['p99'])} — n={st['n']}")
+            else:
+                lines.append(f"  {wname}: no data")
+    await update.effective_message.reply_text("\n".join(lines))
+
+
 # -------- App setup --------
+async def resolve_conversations_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    await asyncio.to_thread(context.application.services["analytics"].resolve_idle)
+
+
+async def reassign_idle_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    moved = context.application.services["assigner"].reassign_idle()
+    if not moved:
+        return
+    cfg = context.application.services["config"]
+    with dbm.connect(cfg.db_path) as con:
+        for uid, old, new in moved:
+            text = f"↪️ Conversation with {uid} reassigned to you (admin {old} idle)."
+            outbox.enqueue(con, new, "send_message", {"text": text, "reply_markup": admin_reply_keyboard_for(uid).to_dict()}, dedup_key=f"assign:{uid}:{new}:{now_ts()}")
+    context.application.services["outbox"].notify()
+
+
+async def checkpoint_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    await context.application.services["dbmaint"].checkpoint()
+
+
+async def optimize_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    await context.application.services["dbmaint"].optimize()
+
+
+async def backup_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    try:
+        await context.application.services["backups"].run()
+    except Exception as e:
+        cfg = context.application.services["config"]
+        with dbm.connect(cfg.db_path) as con:
+            outbox.enqueue(con, cfg.admin_id, "send_message", {"text": f"⚠️ Scheduled backup failed: {e}"}, dedup_key=f"backup-fail:{now_ts()}")
+        context.application.services["outbox"].notify()
+
+
+async def flood_notice_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    cfg = context.application.services["config"]
+    notices = context.application.services["flood"].drain()
+    if not notices:
+        return
+    admins = context.application.services["assigner"].on_duty()
+    with dbm.connect(cfg.db_path) as con:
+        for n in notices:
+            text = f"🔁 {n['suppressed']} similar message(s) suppressed ({n['total']} seen from {n['users']} user(s)).\n\n{n['preview']}"
+            for a in admins:
+                outbox.enqueue(con, a, "send_message", {"text": text}, dedup_key=f"flood:{n['key']}:{a}:{now_ts()}")
+    context.application.services["outbox"].notify()
+
+
+async def memory_sweep_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    context.application.services["memory"].sweep(context.application)
+    # closed conversations leave the assigner's maps on the same schedule
+    context.application.services["assigner"].recount()
+
+
+async def outbox_purge_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    cfg = context.application.services["config"]
+    with dbm.connect(cfg.db_path) as con:
+        outbox.purge_sent(con, older_than_s=7 * 86400)
+
+
 async def load_pending_reminders(app):
-    cfg = app.bot_data["config"]
+    cfg = app.services["config"]
     with dbm.connect(cfg.db_path) as con:
         rows = dbm.query(con, "SELECT id, user_id, text, due_ts FROM reminders WHERE status='active' AND due_ts > ?", (now_ts(),))
     for r in rows:
@@ -711,13 +942,60 @@ async def load_pending_reminders(app):
         app.job_queue.run_once(reminder_fire, when=delay, data={"rid": r["id"], "uid": r["user_id"]}, name=f"rem-{r['id']}")
 
 
-def main() -> None:
-    cfg = load_config()
+def configure_db(cfg) -> None:
     ensure_data_dir(cfg.db_path)
-    dbm.init_db(cfg.db_path)
+    dbm.configure(
+        dbm.Profile(
+            synchronous=cfg.sqlite_synchronous,
+            cache_size_kib=cfg.sqlite_cache_kib,
+            mmap_size_mb=cfg.sqlite_mmap_mb,
+            temp_store=cfg.sqlite_temp_store,
+            busy_timeout_ms=cfg.sqlite_busy_timeout_ms,
+            wal_autocheckpoint=cfg.sqlite_wal_autocheckpoint,
+        )
+    )
+
 
-    app = ApplicationBuilder().token(cfg.bot_token).build()
-    app.bot_data["config"] = cfg
+def build_application(cfg, shard_index: int = 0, shard_count: int = 1):
+    # shard_count > 1: a worker process fed by the ingress (bot/shard.py).
+    # Shard 0 also receives every admin-chat update and runs the scheduled
+    # jobs; all shards share the database.
+    sharded = shard_count > 1
+    primary = shard_index == 0
+    persistence = SQLitePersistence(cfg.db_path, update_interval=cfg.persist_interval, bot_owner=shard_index)
+    send_req, updates_req = build_requests(cfg)
+    builder = ApplicationBuilder().application_class(BotApplication).token(cfg.bot_token).persistence(persistence).request(send_req)
+    builder = builder.updater(None) if sharded else builder.get_updates_request(updates_req)
+    if cfg.tg_base_url:
+        builder = builder.base_url(cfg.tg_base_url)
+    if cfg.tg_base_file_url:
+        builder = builder.base_file_url(cfg.tg_base_file_url)
+    app = builder.build()
+    an = ResponseAnalytics(cfg.db_path, resolve_after=cfg.sla_resolve_after)
+    ob = Outbox(cfg.db_path, workers=cfg.outbox_workers, max_attempts=cfg.outbox_max_attempts, lease=cfg.outbox_lease, owner=f"shard-{shard_index}")
+    ob.on_relay = an.record
+    flood_args = dict(window=cfg.flood_window, threshold=cfg.flood_threshold, min_text_len=cfg.flood_min_text, max_keys=cfg.flood_max_keys)
+    # copies of one message reach several workers; their counts must add up
+    fl = SharedFloodFilter(cfg.db_path, **flood_args) if sharded else FloodFilter(**flood_args)
+    bk = Backups(cfg.db_path, cfg.backup_dir, keep=cfg.backup_keep, compress=cfg.backup_compress, pages=cfg.backup_pages)
+    asg = Assigner(cfg.db_path, cfg.admin_ids, idle_ttl=cfg.admin_idle_ttl, open_window=cfg.conversation_open_window)
+    mt = DbMaintenance(cfg.db_path, truncate_above_bytes=cfg.sqlite_truncate_wal_mb * 1024 * 1024)
+    mg = MemoryGuard(idle_ttl=cfg.mem_idle_ttl, max_users=cfg.mem_max_users, budget_bytes=cfg.mem_budget_mb * 1024 * 1024, exempt=cfg.admin_ids)
+    app.services.update(config=cfg, outbox=ob, memory=mg, flood=fl, backups=bk, dbmaint=mt, assigner=asg, analytics=an)
+
+    metrics.register("net.send", lambda _app: send_req.metrics())
+    if not sharded:
+        metrics.register("net.updates", lambda _app: updates_req.metrics())
+    metrics.register("outbox", lambda _app: ob.metrics())
+    metrics.register("flood", lambda _app: fl.metrics())
+    metrics.register("memory", mg.metrics)
+    metrics.register("backup", lambda _app: bk.metrics())
+    metrics.register("db", lambda _app: mt.metrics())
+    metrics.register("assign", lambda _app: asg.metrics())
+    metrics.register("sla", lambda _app: an.metrics())
+
+    # Activity tracking for memory eviction
+    app.add_handler(TypeHandler(Update, track_activity), group=-1)
 
     # Commands
     app.add_handler(CommandHandler("start", start))
@@ -738,27 +1016,78 @@ def main() -> None:
     app.add_handler(CommandHandler("getfile", getfile_cmd))
 
     # Admin-only capture (optional)
-    app.add_handler(MessageHandler((filters.Chat(cfg.admin_id)) & (filters.Document.ALL | filters.PHOTO | filters.AUDIO | filters.VIDEO | filters.VOICE), file_saver))
+    admin_chats = filters.Chat(chat_id=cfg.admin_ids)
+    app.add_handler(MessageHandler(admin_chats & (filters.Document.ALL | filters.PHOTO | filters.AUDIO | filters.VIDEO | filters.VOICE), file_saver))
 
     # Admin text buttons + reply-mode router
-    app.add_handler(MessageHandler((filters.Chat(cfg.admin_id)) & filters.TEXT & (~filters.COMMAND), admin_text_buttons_handler))
-    app.add_handler(MessageHandler((filters.Chat(cfg.admin_id)) & (~filters.COMMAND), admin_reply_router))
+    app.add_handler(MessageHandler(admin_chats & filters.TEXT & (~filters.COMMAND), admin_text_buttons_handler))
+    app.add_handler(MessageHandler(admin_chats & (~filters.COMMAND), admin_reply_router))
 
     # Non-admin inbound routing
-    app.add_handler(MessageHandler(~filters.Chat(cfg.admin_id) & (~filters.COMMAND), inbound_user_message))
+    app.add_handler(MessageHandler(~admin_chats & (~filters.COMMAND), inbound_user_message))
 
     # Admin management commands
     app.add_handler(CommandHandler("ban", ban_cmd))
     app.add_handler(CommandHandler("unban", unban_cmd))
     app.add_handler(CommandHandler("who", who_cmd))
     app.add_handler(CommandHandler("stats", stats_cmd))
-
-    # Load pending reminders
+    app.add_handler(CommandHandler("outbox", outbox_cmd))
+    app.add_handler(CommandHandler("mem", mem_cmd))
+    app.add_handler(CommandHandler("flood", flood_cmd))
+    app.add_handler(CommandHandler("net", net_cmd))
+    app.add_handler(CommandHandler("metrics", metrics_cmd))
+    app.add_handler(CommandHandler("backup", backup_cmd))
+    app.add_handler(CommandHandler("db", db_cmd))
+    app.add_handler(CommandHandler("admins", admins_cmd))
+    app.add_handler(CommandHandler("assign", assign_cmd))
+    app.add_handler(CommandHandler("sla", sla_cmd))
+
+    # Load pending reminders, start outbox delivery workers.
     async def _post_startup(_: ApplicationBuilder):
+        asg.load()
+        an.refresh()
+        mg.seed(app.bot_data)
+        await ob.start(app.bot, recover=not sharded)
+        # per-process state: every shard sweeps its own users
+        app.job_queue.run_repeating(memory_sweep_job, interval=cfg.mem_sweep_interval, first=cfg.mem_sweep_interval)
+        if not primary:
+            return
+        if fl.enabled:
+            app.job_queue.run_repeating(flood_notice_job, interval=30, first=30)
+        mt.start()
         await load_pending_reminders(app)
+        app.job_queue.run_repeating(outbox_purge_job, interval=3600, first=60)
+        if cfg.sqlite_checkpoint_interval > 0:
+            app.job_queue.run_repeating(checkpoint_job, interval=cfg.sqlite_checkpoint_interval, first=cfg.sqlite_checkpoint_interval)
+        if cfg.sqlite_optimize_interval > 0:
+            app.job_queue.run_repeating(optimize_job, interval=cfg.sqlite_optimize_interval, first=cfg.sqlite_optimize_interval)
+        app.job_queue.run_repeating(resolve_conversations_job, interval=60, first=60)
+        if len(cfg.admin_ids) > 1:
+            app.job_queue.run_repeating(reassign_idle_job, interval=60, first=60)
+        if cfg.backup_interval > 0:
+            app.job_queue.run_repeating(backup_job, interval=cfg.backup_interval, first=min(cfg.backup_interval, 600))
+
+    async def _post_stop(_: ApplicationBuilder):
+        await ob.stop()
+
+    async def _post_shutdown(_: ApplicationBuilder):
+        # after the final persistence flush
+        mt.stop()
 
     app.post_init = _post_startup  # type: ignore
+    app.post_stop = _post_stop  # type: ignore
+    app.post_shutdown = _post_shutdown  # type: ignore
+    return app
+
 
+def main() -> None:
+    cfg = load_config()
+    configure_db(cfg)
+    dbm.init_db(cfg.db_path)
+    if cfg.shard_workers > 1:
+        run_ingress(cfg)
+        return
+    app = build_application(cfg)
     print("Bot starting... press Ctrl+C to stop.")
     app.run_polling(allowed_updates=Update.ALL_TYPES)
 
@@ -0,0 +1,36 @@
+from typing import Any, Optional
+
+# kind -> (Bot send method, file argument); also the order a message is probed in
+SEND = {
+    "document": ("send_document", "document"),
+    "photo": ("send_photo", "photo"),
+    "audio": ("send_audio", "audio"),
+    "video": ("send_video", "video"),
+    "voice": ("send_voice", "voice"),
+}
+
+
+def extract(m: Any) -> Optional[tuple[str, str, str]]:
+    # (kind, file_id, file_unique_id) of a Message's attachment, probed in
+    # SEND order. Plain attribute tests: a getattr loop over SEND costs about
+    # twice as much per message. Text messages never carry an attachment.
+    if m.text:
+        return None
+    if m.document:
+        obj, kind = m.document, "document"
+    elif m.photo:
+        obj, kind = m.photo[-1], "photo"  # largest size
+    elif m.audio:
+        obj, kind = m.audio, "audio"
+    elif m.video:
+        obj, kind = m.video, "video"
+    elif m.voice:
+        obj, kind = m.voice, "voice"
+    else:
+        return None
+    return kind, obj.file_id, obj.file_unique_id
+
+
+def send_args(kind: str, file_id: str, caption: Optional[str]) -> tuple[str, dict[str, Any]]:
+    method, arg = SEND[kind]
+    return method, {arg: file_id, "caption": caption}
@@ -0,0 +1,114 @@
+import sys
+import time
+from collections import OrderedDict
+from typing import Any, Iterable, Optional
+
+RL_PREFIX = "rl:"
+
+
+def deep_size(obj: Any, seen: Optional[set[int]] = None) -> int:
+    # Rough recursive sys.getsizeof; good enough to compare categories
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_size(k, seen) + deep_size(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_size(v, seen) for v in obj)
+    return size
+
+
+class MemoryGuard:
+    # Tracks the last activity of every non-exempt user and expires their
+    # runtime state (user_data, private chat_data, rate-limit key) once idle
+    # for idle_ttl, when more than max_users are resident, or when the
+    # estimated footprint exceeds budget_bytes. Oldest activity goes first.
+    #
+    # Eviction goes through Application.drop_*_data, so with persistence the
+    # stored copy is expired as well — idle state is dropped, not unloaded.
+
+    def __init__(self, idle_ttl: int = 86400, max_users: int = 10000, budget_bytes: int = 0, exempt: Iterable[int] = ()):
+        self.idle_ttl = idle_ttl
+        self.max_users = max_users
+        self.budget_bytes = budget_bytes
+        self.exempt = set(exempt)
+        self.evicted = {"idle": 0, "lru": 0, "budget": 0}
+        self._seen: "OrderedDict[int, float]" = OrderedDict()
+
+    def touch(self, user_id: int, ts: Optional[float] = None) -> None:
+        if user_id in self.exempt:
+            return
+        self._seen[user_id] = ts if ts is not None else time.time()
+        self._seen.move_to_end(user_id)
+
+    def seed(self, bot_data: dict) -> None:
+        # Users known only through persisted rate-limit keys (from before a
+        # restart) are tracked too, or they would never expire.
+        rl = [(v, int(k[len(RL_PREFIX):])) for k, v in bot_data.items() if isinstance(k, str) and k.startswith(RL_PREFIX) and k[len(RL_PREFIX):].isdigit()]
+        for ts, uid in sorted(rl):
+            if uid not in self._seen:
+                self.touch(uid, ts)
+        self._seen = OrderedDict(sorted(self._seen.items(), key=lambda kv: kv[1]))
+
+    def _user_size(self, app, uid: int) -> int:
+        return (
+            deep_size(app.user_data.get(uid, {}))
+            + deep_size(app.chat_data.get(uid, {}))
+            + deep_size(app.bot_data.get(f"{RL_PREFIX}{uid}"))
+        )
+
+    def _evict(self, app, uid: int, why: str) -> None:
+        self._seen.pop(uid, None)
+        if uid in app.user_data:
+            app.drop_user_data(uid)
+        if uid in app.chat_data:
+            app.drop_chat_data(uid)
+        app.bot_data.pop(f"{RL_PREFIX}{uid}", None)
+        self.evicted[why] += 1
+
+    def sweep(self, app, now: Optional[float] = None) -> int:
+        now = now if now is not None else time.time()
+        n = 0
+        while self._seen:
+            uid, ts = next(iter(self._seen.items()))
+            if now - ts >= self.idle_ttl:
+                why = "idle"
+            elif len(self._seen) > self.max_users:
+                why = "lru"
+            else:
+                break
+            self._evict(app, uid, why)
+            n += 1
+        if self.budget_bytes:
+            sizes = {uid: self._user_size(app, uid) for uid in self._seen}
+            total = sum(sizes.values())
+            while self._seen and total > self.budget_bytes:
+                uid = next(iter(self._seen))
+                total -= sizes[uid]
+                self._evict(app, uid, "budget")
+                n += 1
+        return n
+
+    def metrics(self, app) -> dict[str, int]:
+        # Cheap counts only; report() walks every object for size estimates
+        return {
+            "tracked_users": len(self._seen),
+            "user_data": len(app.user_data),
+            "chat_data": len(app.chat_data),
+            **{f"evicted_{k}": v for k, v in self.evicted.items()},
+        }
+
+    def report(self, app) -> dict[str, tuple[int, int]]:
+        # category -> (entries, estimated bytes)
+        rl = {k: v for k, v in app.bot_data.items() if isinstance(k, str) and k.startswith(RL_PREFIX)}
+        other = {k: v for k, v in app.bot_data.items() if k not in rl}
+        return {
+            "user_data": (len(app.user_data), deep_size(dict(app.user_data))),
+            "chat_data": (len(app.chat_data), deep_size(dict(app.chat_data))),
+            "rate_limit": (len(rl), deep_size(rl)),
+            "bot_data_other": (len(other), deep_size(other)),
+            "tracker": (len(self._seen), deep_size(self._seen)),
+        }
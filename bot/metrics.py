@@ -0,0 +1,27 @@
+from typing import Any, Callable
+
+# name -> callable(application) returning a flat {metric: value} dict
+_SOURCES: dict[str, Callable[[Any], dict[str, Any]]] = {}
+
+
+def register(name: str, source: Callable[[Any], dict[str, Any]]) -> None:
+    _SOURCES[name] = source
+
+
+def collect(app) -> dict[str, dict[str, Any]]:
+    out = {}
+    for name, source in _SOURCES.items():
+        try:
+            out[name] = source(app)
+        except Exception as e:
+            out[name] = {"error": f"{type(e).__name__}: {e}"}
+    return out
+
+
+def render(snapshot: dict[str, dict[str, Any]]) -> str:
+    # "<source>.<metric> <value>" per line, easy to grep or scrape
+    lines = []
+    for name, values in snapshot.items():
+        for k, v in values.items():
+            lines.append(f"{name}.{k} {v}")
+    return "\n".join(lines)
@@ -0,0 +1,300 @@
+import asyncio
+import calendar
+import json
+import logging
+import sqlite3
+import time
+from typing import Any, Callable, Iterable, Optional
+
+from telegram import KeyboardButton, ReplyKeyboardMarkup
+from telegram.error import BadRequest, Forbidden, RetryAfter
+
+from . import db as dbm
+
+log = logging.getLogger(__name__)
+
+
+# -------- Enqueue (called inside the handler's transaction) --------
+def enqueue(
+    con,
+    chat_id: int,
+    method: str,
+    kwargs: dict[str, Any],
+    dedup_key: str,
+    relay: Optional[tuple[int, str, int, int]] = None,
+    followups: Optional[list[dict[str, Any]]] = None,
+) -> Optional[int]:
+    # relay = (user_id, direction, known_msg_id, admin_id); the worker fills in
+    # the other side of the relays row from the id of the message it actually
+    # sent. followups are best-effort send_message kwargs delivered after success.
+    rel_uid, rel_dir, rel_msg, rel_admin = relay if relay else (None, None, None, None)
+    payload = json.dumps({"kwargs": kwargs, "followups": followups or []}, ensure_ascii=False)
+    cur = con.execute(
+        "INSERT OR IGNORE INTO outbox(dedup_key, chat_id, method, payload, relay_user_id, relay_direction, relay_msg_id, relay_admin_id, next_attempt_ts) "
+        "VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (dedup_key, chat_id, method, payload, rel_uid, rel_dir, rel_msg, rel_admin, int(time.time())),
+    )
+    return int(cur.lastrowid) if cur.rowcount else None
+
+
+def _markup(d: Optional[dict[str, Any]]) -> Optional[ReplyKeyboardMarkup]:
+    if not d:
+        return None
+    rows = [[KeyboardButton.de_json(b, None) for b in row] for row in d["keyboard"]]
+    return ReplyKeyboardMarkup(rows, resize_keyboard=d.get("resize_keyboard"), one_time_keyboard=d.get("one_time_keyboard"))
+
+
+def _decode(kwargs: dict[str, Any]) -> dict[str, Any]:
+    if "reply_markup" in kwargs:
+        kwargs = dict(kwargs, reply_markup=_markup(kwargs["reply_markup"]))
+    return kwargs
+
+
+def _queued_ts(row: dict[str, Any]) -> float:
+    # created_at is SQLite CURRENT_TIMESTAMP (UTC)
+    try:
+        return float(calendar.timegm(time.strptime(row["created_at"], "%Y-%m-%d %H:%M:%S")))
+    except (TypeError, ValueError):
+        return time.time()
+
+
+# -------- Delivery workers --------
+class Outbox:
+    def __init__(self, db_path: str, workers: int = 4, max_attempts: int = 8, base_delay: float = 2.0, max_delay: float = 300.0, poll_interval: float = 1.0, lease: float = 120.0, owner: str = ""):
+        self.db_path = db_path
+        self.workers = max(1, workers)
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+        # A row this process claimed longer ago than this, and that none of its
+        # tasks is still handling, was abandoned and goes back to pending. Rows
+        # of other processes are only recovered by the supervisor, once that
+        # process is known to be dead.
+        self.lease = lease
+        # Recorded as claimed_by, so a supervisor can requeue exactly the rows
+        # of a process that died
+        self.owner = owner
+        self.stats = {"sent": 0, "retried": 0, "dead": 0, "errors": 0, "reclaimed": 0}
+        # on_relay(con, user_id, direction, queued_ts) runs in the transaction
+        # that writes each relays row
+        self.on_relay: Optional[Callable[[Any, int, str, float], None]] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._tasks: list[asyncio.Task] = []
+        self._reclaimed_at = 0.0
+        self._inflight: set[int] = set()
+
+    def notify(self) -> None:
+        if self._wake is not None:
+            self._wake.set()
+
+    async def start(self, bot, recover: bool = True) -> None:
+        # Rows left in 'sending' by a crash are retried (at-least-once delivery).
+        # With several processes sharing the table only the supervisor may do
+        # this, before any worker starts.
+        if recover:
+            with dbm.connect(self.db_path) as con:
+                recover_sending(con)
+        self._wake = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._run(bot), name=f"outbox-{i}") for i in range(self.workers)]
+
+    async def stop(self) -> None:
+        for t in self._tasks:
+            t.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def metrics(self) -> dict[str, Any]:
+        with dbm.connect(self.db_path) as con:
+            c = counts(con)
+        return {"pending": c.get("pending", 0), "dead": c.get("dead", 0), **self.stats}
+
+    def _claim(self) -> Optional[dict[str, Any]]:
+        # One message in flight per chat: a row is only due once every earlier
+        # row for its chat is sent or dead, so a message waiting out a backoff
+        # or RetryAfter holds back the ones queued after it.
+        while True:
+            with dbm.connect(self.db_path) as con:
+                rows = dbm.query(
+                    con,
+                    "SELECT * FROM outbox WHERE status='pending' AND next_attempt_ts<=? "
+                    "AND NOT EXISTS (SELECT 1 FROM outbox o2 WHERE o2.chat_id=outbox.chat_id AND o2.id<outbox.id AND o2.status IN ('pending','sending')) "
+                    "ORDER BY id LIMIT 1",
+                    (int(time.time()),),
+                )
+                if not rows:
+                    return None
+                n = dbm.execute(
+                    con,
+                    "UPDATE outbox SET status='sending', attempts=attempts+1, claimed_at=?, claimed_by=? WHERE id=? AND status='pending'",
+                    (int(time.time()), self.owner, rows[0]["id"]),
+                )
+            if n:
+                row = dict(rows[0])
+                row["attempts"] += 1
+                return row
+
+    def _reclaim_expired(self) -> None:
+        # Checked at most every lease/4 seconds by whichever worker is idle
+        now = time.time()
+        if now - self._reclaimed_at < self.lease / 4:
+            return
+        self._reclaimed_at = now
+        with dbm.connect(self.db_path) as con:
+            n = recover_sending(con, claimed_before=now - self.lease, owner=self.owner, keep=self._inflight)
+        if n:
+            self.stats["reclaimed"] += n
+            log.warning("outbox: %s row(s) held in 'sending' past the %ss lease requeued", n, self.lease)
+
+    async def _run(self, bot) -> None:
+        while True:
+            try:
+                row = self._claim()
+            except Exception:
+                log.exception("outbox claim failed")
+                row = None
+            if row is None:
+                try:
+                    self._reclaim_expired()
+                except Exception:
+                    log.exception("outbox lease recovery failed")
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            self._inflight.add(row["id"])
+            try:
+                await self._deliver(bot, row)
+            except Exception as e:
+                self.stats["errors"] += 1
+                log.exception("outbox #%s delivery failed", row["id"])
+                if not row.get("delivered"):
+                    # Failed before reaching Telegram: an ordinary retry
+                    try:
+                        self._fail(row, f"{type(e).__name__}: {e}")
+                    except Exception:
+                        log.exception("outbox #%s could not be rescheduled", row["id"])
+                # A row that reached Telegram is never rescheduled: _deliver
+                # marks it sent before anything else can fail.
+            finally:
+                self._inflight.discard(row["id"])
+
+    async def _deliver(self, bot, row: dict[str, Any]) -> None:
+        payload = json.loads(row["payload"])
+        try:
+            sent = await getattr(bot, row["method"])(chat_id=row["chat_id"], **_decode(payload["kwargs"]))
+        except RetryAfter as e:
+            self._fail(row, str(e), delay=float(e.retry_after))
+            return
+        except (Forbidden, BadRequest) as e:
+            # Permanent: user blocked the bot, chat gone, bad file id, ...
+            self._fail(row, str(e), permanent=True)
+            return
+        except Exception as e:
+            self._fail(row, f"{type(e).__name__}: {e}")
+            return
+        row["delivered"] = True
+
+        # The message is out: the row must now become 'sent' no matter how long
+        # the database stays locked, or a later recovery would send it twice.
+        # It stays in _inflight meanwhile, so the lease does not touch it. The
+        # relay row follows separately.
+        delay = 0.1
+        while True:
+            try:
+                self._mark_sent(row["id"])
+                break
+            except sqlite3.Error as e:
+                log.warning("outbox #%s sent but not yet marked (%s); retrying in %.1fs", row["id"], e, delay)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 5.0)
+        self.stats["sent"] += 1
+        for attempt in range(5):
+            try:
+                self._write_relay(row, sent.message_id)
+                break
+            except sqlite3.Error:
+                if attempt == 4:
+                    # replies to this message cannot be routed, but it is not resent
+                    log.exception("outbox #%s: relay row not written", row["id"])
+                    break
+                await asyncio.sleep(0.2 * 2**attempt)
+
+        for f in payload["followups"]:
+            try:
+                await bot.send_message(**_decode(f))
+            except Exception:
+                pass
+
+    def _mark_sent(self, row_id: int) -> None:
+        with dbm.connect(self.db_path) as con:
+            dbm.execute(con, "UPDATE outbox SET status='sent', sent_at=CURRENT_TIMESTAMP, last_error=NULL WHERE id=?", (row_id,))
+
+    def _write_relay(self, row: dict[str, Any], message_id: int) -> None:
+        if not row["relay_direction"]:
+            return
+        with dbm.connect(self.db_path) as con:
+            if row["relay_direction"] == "to_admin":
+                dbm.insert(con, "INSERT INTO relays(user_id, direction, admin_msg_id, peer_msg_id, admin_id) VALUES(?, 'to_admin', ?, ?, ?)", (row["relay_user_id"], message_id, row["relay_msg_id"], row["relay_admin_id"]))
+            elif row["relay_direction"] == "to_user":
+                dbm.insert(con, "INSERT INTO relays(user_id, direction, admin_msg_id, peer_msg_id, admin_id) VALUES(?, 'to_user', ?, ?, ?)", (row["relay_user_id"], row["relay_msg_id"], message_id, row["relay_admin_id"]))
+            if self.on_relay is not None:
+                # timed from enqueue, i.e. when the user or admin wrote, not when a retry got through;
+                # a failing hook must not roll back the relay it describes
+                try:
+                    self.on_relay(con, row["relay_user_id"], row["relay_direction"], _queued_ts(row))
+                except Exception:
+                    log.exception("outbox #%s: on_relay hook failed", row["id"])
+
+    def _fail(self, row: dict[str, Any], error: str, delay: Optional[float] = None, permanent: bool = False) -> None:
+        attempts = row["attempts"]
+        if permanent or attempts >= self.max_attempts:
+            with dbm.connect(self.db_path) as con:
+                dbm.execute(con, "UPDATE outbox SET status='dead', last_error=? WHERE id=?", (error, row["id"]))
+            self.stats["dead"] += 1
+            log.warning("outbox #%s dead-lettered after %s attempt(s): %s", row["id"], attempts, error)
+            return
+        if delay is None:
+            delay = min(self.max_delay, self.base_delay * 2 ** (attempts - 1))
+        with dbm.connect(self.db_path) as con:
+            dbm.execute(
+                con,
+                "UPDATE outbox SET status='pending', last_error=?, next_attempt_ts=? WHERE id=?",
+                (error, int(time.time() + delay), row["id"]),
+            )
+        self.stats["retried"] += 1
+
+
+# -------- Maintenance / inspection --------
+def recover_sending(con, claimed_before: Optional[float] = None, owner: Optional[str] = None, keep: Iterable[int] = ()) -> int:
+    # All rows in 'sending', or only those whose lease started before the
+    # given time and/or that were claimed by the given outbox owner; ids in
+    # keep are left alone
+    sql, args = "UPDATE outbox SET status='pending' WHERE status='sending'", []
+    keep = list(keep)
+    if keep:
+        sql += f" AND id NOT IN ({','.join('?' * len(keep))})"
+        args.extend(keep)
+    if claimed_before is not None:
+        sql += " AND COALESCE(claimed_at, 0) < ?"
+        args.append(int(claimed_before))
+    if owner is not None:
+        sql += " AND claimed_by=?"
+        args.append(owner)
+    return dbm.execute(con, sql, tuple(args))
+
+
+def counts(con) -> dict[str, int]:
+    rows = dbm.query(con, "SELECT status, COUNT(*) AS c FROM outbox GROUP BY status")
+    return {r["status"]: r["c"] for r in rows}
+
+
+def requeue_dead(con) -> int:
+    return dbm.execute(con, "UPDATE outbox SET status='pending', attempts=0, next_attempt_ts=0 WHERE status='dead'")
+
+
+def purge_sent(con, older_than_s: int) -> int:
+    # Sent rows are kept for a while so late duplicates still hit dedup_key
+    return dbm.execute(con, "DELETE FROM outbox WHERE status='sent' AND sent_at < datetime('now', ?)", (f"-{int(older_than_s)} seconds",))
@@ -0,0 +1,158 @@
+import asyncio
+import json
+from typing import Any, Optional
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from . import db as dbm
+
+
+class SQLitePersistence(BasePersistence):
+    # user_data / chat_data / bot_data stored one row per (scope, owner, key)
+    # in the bot's own database.
+    #
+    # - user/chat data is loaded lazily on first use (refresh_*), not at startup
+    # - each update_* call is diffed against what was last written, so only
+    #   changed or removed keys hit the database
+    # - writes issued in the same persistence round are coalesced into one
+    #   transaction
+    #
+    # Only str keys with JSON-serializable values are stored. bot_data holds
+    # persistable state only; runtime services live on the application.
+
+    def __init__(self, db_path: str, update_interval: float = 30, bot_owner: int = 0):
+        super().__init__(store_data=PersistenceInput(callback_data=False), update_interval=update_interval)
+        self.db_path = db_path
+        self.bot_owner = bot_owner
+        self._snap: dict[tuple[str, int], dict[str, Any]] = {}
+        self._pending: dict[tuple[str, int, str], Optional[str]] = {}
+        self._drops: set[tuple[str, int]] = set()
+        self._flush_task: Optional[asyncio.Task] = None
+
+    # -------- Loading --------
+    def _load(self, scope: str, owner: int) -> dict[str, Any]:
+        with dbm.connect(self.db_path) as con:
+            rows = dbm.query(con, "SELECT key, value FROM context_data WHERE scope=? AND owner_id=?", (scope, owner))
+        # Separate decodes: in-place edits to the live dict must not leak into the snapshot
+        self._snap[(scope, owner)] = {r["key"]: json.loads(r["value"]) for r in rows}
+        return {r["key"]: json.loads(r["value"]) for r in rows}
+
+    def _hydrate(self, scope: str, owner: int, data: dict) -> None:
+        if (scope, owner) in self._snap:
+            return
+        for k, v in self._load(scope, owner).items():
+            data.setdefault(k, v)
+
+    async def get_user_data(self) -> dict[int, dict[Any, Any]]:
+        return {}
+
+    async def get_chat_data(self) -> dict[int, dict[Any, Any]]:
+        return {}
+
+    async def get_bot_data(self) -> dict[Any, Any]:
+        return self._load("bot", self.bot_owner)
+
+    async def get_callback_data(self) -> None:
+        return None
+
+    async def get_conversations(self, name: str) -> dict:
+        return {}
+
+    async def refresh_user_data(self, user_id: int, user_data: dict[Any, Any]) -> None:
+        self._hydrate("user", user_id, user_data)
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict[Any, Any]) -> None:
+        self._hydrate("chat", chat_id, chat_data)
+
+    async def refresh_bot_data(self, bot_data: dict[Any, Any]) -> None:
+        pass
+
+    # -------- Dirty tracking --------
+    def _diff(self, scope: str, owner: int, data: dict[Any, Any]) -> None:
+        snap = self._snap.get((scope, owner))
+        if snap is None:
+            # Written before ever being read (e.g. from a job): diff against the DB
+            snap = self._load(scope, owner)
+        for k, v in data.items():
+            if not isinstance(k, str) or (k in snap and snap[k] == v):
+                continue
+            try:
+                enc = json.dumps(v, ensure_ascii=False)
+            except (TypeError, ValueError):
+                continue
+            snap[k] = v
+            self._pending[(scope, owner, k)] = enc
+        for k in [k for k in snap if k not in data]:
+            del snap[k]
+            self._pending[(scope, owner, k)] = None
+
+    def _write_pending(self) -> None:
+        drops, self._drops = self._drops, set()
+        pending, self._pending = self._pending, {}
+        if not drops and not pending:
+            return
+        try:
+            with dbm.connect(self.db_path) as con:
+                con.executemany("DELETE FROM context_data WHERE scope=? AND owner_id=?", list(drops))
+                con.executemany(
+                    "DELETE FROM context_data WHERE scope=? AND owner_id=? AND key=?",
+                    [k for k, v in pending.items() if v is None],
+                )
+                con.executemany(
+                    "INSERT INTO context_data(scope, owner_id, key, value) VALUES(?, ?, ?, ?) "
+                    "ON CONFLICT(scope, owner_id, key) DO UPDATE SET value=excluded.value",
+                    [(*k, v) for k, v in pending.items() if v is not None],
+                )
+        except Exception:
+            # The snapshot already reflects these changes, so they would never be
+            # diffed again: keep them for the next round (newer writes win).
+            self._drops = drops | self._drops
+            self._pending = {**pending, **self._pending}
+            raise
+
+    async def _flush_soon(self) -> None:
+        # update_* calls of one persistence round run concurrently; the first one
+        # schedules the write and the rest join it.
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_after_round())
+        await asyncio.shield(self._flush_task)
+
+    async def _flush_after_round(self) -> None:
+        await asyncio.sleep(0)
+        self._flush_task = None
+        self._write_pending()
+
+    # -------- Updates --------
+    async def update_user_data(self, user_id: int, data: dict[Any, Any]) -> None:
+        self._diff("user", user_id, data)
+        await self._flush_soon()
+
+    async def update_chat_data(self, chat_id: int, data: dict[Any, Any]) -> None:
+        self._diff("chat", chat_id, data)
+        await self._flush_soon()
+
+    async def update_bot_data(self, data: dict[Any, Any]) -> None:
+        self._diff("bot", self.bot_owner, data)
+        await self._flush_soon()
+
+    async def update_callback_data(self, data: Any) -> None:
+        pass
+
+    async def update_conversation(self, name: str, key: tuple, new_state: Optional[object]) -> None:
+        pass
+
+    def _drop(self, scope: str, owner: int) -> None:
+        self._snap.pop((scope, owner), None)
+        self._pending = {k: v for k, v in self._pending.items() if k[:2] != (scope, owner)}
+        self._drops.add((scope, owner))
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._drop("user", user_id)
+        await self._flush_soon()
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        self._drop("chat", chat_id)
+        await self._flush_soon()
+
+    async def flush(self) -> None:
+        self._write_pending()
@@ -0,0 +1,317 @@
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import time
+from typing import Any, Callable, Optional
+
+from telegram import Update
+from telegram.ext import ApplicationBuilder
+
+from . import db as dbm
+from . import metrics
+from . import outbox
+from .config import load_config
+from .transport import build_requests
+
+log = logging.getLogger(__name__)
+
+# Ingress and workers talk newline-delimited JSON over one Unix socket:
+#   worker → ingress  {"hello": <index>}           once per connection
+#   ingress → worker  {"update": <Update.to_dict()>}
+#   worker → ingress  {"ack": <update_id>}         once the application has processed it
+#   both ways         {"event": {"kind": ..., ...}}  invalidation, relayed to every other worker
+LINE_LIMIT = 4 * 1024 * 1024
+
+
+def shard_for(update: Update, count: int, admin_ids) -> int:
+    # Same user → same worker, so per-user ordering holds. Admin chats and
+    # updates without a user go to worker 0.
+    chat = update.effective_chat
+    if chat is not None and chat.id in admin_ids:
+        return 0
+    user = update.effective_user
+    if user is None:
+        return 0
+    return user.id % count
+
+
+def _line(obj: dict[str, Any]) -> bytes:
+    return (json.dumps(obj, ensure_ascii=False, separators=(",", ":")) + "\n").encode()
+
+
+# -------- Ingress (polling process) --------
+class Ingress:
+    def __init__(self, cfg):
+        self.cfg = cfg
+        self.count = cfg.shard_workers
+        self.admin_ids = set(cfg.admin_ids)
+        self.stats: dict[str, Any] = {"routed": [0] * self.count, "events": 0, "restarts": 0, "replayed": 0}
+        self._queues = [asyncio.Queue(maxsize=max(1, cfg.shard_queue)) for _ in range(self.count)]
+        self._unacked: list[dict[int, bytes]] = [{} for _ in range(self.count)]  # update_id → line, written but not acked
+        self._writers: dict[int, asyncio.StreamWriter] = {}
+        self._connected = [asyncio.Event() for _ in range(self.count)]
+        self._procs: list[Optional[multiprocessing.Process]] = [None] * self.count
+        self._drained = [False] * self.count  # sender done: nothing more goes to that worker
+        self._ctx = multiprocessing.get_context("spawn")
+        self._stopping = False
+
+    # -------- Worker processes --------
+    def _spawn(self, i: int) -> None:
+        p = self._ctx.Process(target=worker_main, args=(i, self.count, self.cfg.shard_socket), name=f"shard-{i}")
+        p.start()
+        self._procs[i] = p
+
+    async def _supervise(self) -> None:
+        while not self._stopping:
+            await asyncio.sleep(1)
+            for i, p in enumerate(self._procs):
+                if p is not None and not p.is_alive() and not self._stopping:
+                    # Messages the dead worker had claimed go back to the queue;
+                    # rows claimed by live workers are left alone.
+                    with dbm.connect(self.cfg.db_path) as con:
+                        n = outbox.recover_sending(con, owner=f"shard-{i}")
+                    log.warning("shard %s exited with %s; requeued %s message(s), restarting", i, p.exitcode, n)
+                    self.stats["restarts"] += 1
+                    self._spawn(i)
+
+    # -------- Socket --------
+    async def _on_connect(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            hello = json.loads(await reader.readline())
+            i = int(hello["hello"])
+        except Exception:
+            writer.close()
+            return
+        self._writers[i] = writer
+        # Updates the previous process received but never acked (it crashed
+        # before handling them) go out again ahead of anything new.
+        pending = self._unacked[i]
+        for line in pending.values():
+            writer.write(line)
+        if pending:
+            self.stats["replayed"] += len(pending)
+            log.warning("shard %s: replaying %s unacknowledged update(s)", i, len(pending))
+        self._connected[i].set()
+        if self._drained[i] and writer.can_write_eof():
+            # (re)started while shutting down; let it stop in order right away
+            writer.write_eof()
+        try:
+            while line := await reader.readline():
+                msg = json.loads(line)
+                if "ack" in msg:
+                    pending.pop(msg["ack"], None)
+                elif "event" in msg:
+                    self.stats["events"] += 1
+                    for j in range(self.count):
+                        if j != i:
+                            await self._queues[j].put((None, line))
+        except (ConnectionError, json.JSONDecodeError) as e:
+            log.warning("shard %s link error: %s", i, e)
+        finally:
+            if self._writers.get(i) is writer:
+                del self._writers[i]
+                self._connected[i].clear()
+            writer.close()
+
+    async def _sender(self, i: int) -> None:
+        # One writer per worker keeps the per-user order of updates. An update
+        # stays in _unacked until the worker acks it, so one lost with the
+        # connection is replayed on the next; events are not kept, a restarted
+        # worker loads that state from the database.
+        q = self._queues[i]
+        while True:
+            item = await q.get()
+            if item is None:
+                self._drained[i] = True
+                w = self._writers.get(i)
+                if w is not None and w.can_write_eof():
+                    w.write_eof()
+                return
+            key, line = item
+            await self._connected[i].wait()
+            w = self._writers[i]
+            if key is not None:
+                self._unacked[i][key] = line
+            try:
+                w.write(line)
+                await w.drain()
+            except ConnectionError:
+                if self._writers.get(i) is w:
+                    self._connected[i].clear()
+
+    async def route(self, update: Update) -> None:
+        i = shard_for(update, self.count, self.admin_ids)
+        self.stats["routed"][i] += 1
+        await self._queues[i].put((update.update_id, _line({"update": update.to_dict()})))
+
+    # -------- Lifecycle --------
+    async def run(self) -> None:
+        path = self.cfg.shard_socket
+        if os.path.exists(path):
+            os.remove(path)
+        server = await asyncio.start_unix_server(self._on_connect, path=path, limit=LINE_LIMIT)
+        # Only the supervisor may recover rows a previous run left in 'sending'
+        with dbm.connect(self.cfg.db_path) as con:
+            outbox.recover_sending(con)
+        for i in range(self.count):
+            self._spawn(i)
+        senders = [asyncio.create_task(self._sender(i), name=f"shard-send-{i}") for i in range(self.count)]
+        supervisor = asyncio.create_task(self._supervise())
+
+        send_req, updates_req = build_requests(self.cfg)
+        builder = ApplicationBuilder().token(self.cfg.bot_token).request(send_req).get_updates_request(updates_req).job_queue(None)
+        if self.cfg.tg_base_url:
+            builder = builder.base_url(self.cfg.tg_base_url)
+        if self.cfg.tg_base_file_url:
+            builder = builder.base_file_url(self.cfg.tg_base_file_url)
+        app = builder.build()
+
+        # The updater fills app.update_queue; the Application itself is never
+        # started, so nothing else consumes it. A None in the queue stops routing.
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, app.update_queue.put_nowait, None)
+        await app.initialize()
+        await app.updater.start_polling(allowed_updates=Update.ALL_TYPES)
+        print(f"Bot starting with {self.count} worker processes... press Ctrl+C to stop.")
+        try:
+            while (update := await app.update_queue.get()) is not None:
+                await self.route(update)
+        finally:
+            await app.updater.stop()
+            # Updates fetched but not yet routed still go out before workers stop
+            while not app.update_queue.empty():
+                update = app.update_queue.get_nowait()
+                if update is not None:
+                    await self.route(update)
+            await app.shutdown()
+
+            self._stopping = True
+            supervisor.cancel()
+            for q in self._queues:
+                await q.put(None)
+            await asyncio.wait(senders, timeout=30)
+            for p in self._procs:
+                if p is not None:
+                    await asyncio.to_thread(p.join, 60)
+                    if p.is_alive():
+                        p.terminate()
+            for i, pending in enumerate(self._unacked):
+                if pending:
+                    log.warning("shard %s stopped with %s unacknowledged update(s): %s", i, len(pending), sorted(pending))
+            server.close()
+            await server.wait_closed()
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def run_ingress(cfg) -> None:
+    asyncio.run(Ingress(cfg).run())
+
+
+# -------- Worker side --------
+class WorkerLink:
+    def __init__(self, index: int, socket_path: str):
+        self.index = index
+        self.socket_path = socket_path
+        self.handlers: dict[str, Callable[[dict[str, Any]], None]] = {}
+        self.stats = {"updates": 0, "acks": 0, "events_in": 0, "events_out": 0}
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+
+    async def connect(self, timeout: float = 30) -> None:
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                self._reader, self._writer = await asyncio.open_unix_connection(self.socket_path, limit=LINE_LIMIT)
+                break
+            except (FileNotFoundError, ConnectionRefusedError):
+                if time.monotonic() > deadline:
+                    raise
+                await asyncio.sleep(0.2)
+        self._writer.write(_line({"hello": self.index}))
+        await self._writer.drain()
+
+    def publish(self, event: dict[str, Any]) -> None:
+        if self._writer is not None and not self._writer.is_closing():
+            self._writer.write(_line({"event": event}))
+            self.stats["events_out"] += 1
+
+    def ack(self, update: object) -> None:
+        # Called by the application after processing; until then the ingress
+        # keeps the update to replay it to a restarted worker.
+        if isinstance(update, Update) and self._writer is not None and not self._writer.is_closing():
+            self._writer.write(_line({"ack": update.update_id}))
+            self.stats["acks"] += 1
+
+    async def serve(self, app) -> None:
+        # Returns when the ingress closes the connection
+        while line := await self._reader.readline():
+            msg = json.loads(line)
+            if "update" in msg:
+                self.stats["updates"] += 1
+                await app.update_queue.put(Update.de_json(msg["update"], app.bot))
+            elif "event" in msg:
+                self.stats["events_in"] += 1
+                handler = self.handlers.get(msg["event"].get("kind"))
+                if handler is not None:
+                    handler(msg["event"])
+
+    async def close(self) -> None:
+        # flushes the acks written while the application stopped
+        if self._writer is not None:
+            self._writer.close()
+            await self._writer.wait_closed()
+
+    def metrics(self) -> dict[str, Any]:
+        return {"index": self.index, **self.stats}
+
+
+async def _run_worker(app, link: WorkerLink) -> None:
+    # Mirrors Application.run_polling() minus the updater
+    await app.initialize()
+    if app.post_init:
+        await app.post_init(app)
+    loop = asyncio.get_running_loop()
+    asg = app.services["assigner"]
+    # Assigner events are raised inside a handler's transaction; handlers do
+    # not await while it is open, so by the next loop iteration it has
+    # committed and the other workers read the new row.
+    asg.on_change = lambda event: loop.call_soon(link.publish, event)
+    for kind in ("owner", "inbound", "admin_seen"):
+        link.handlers[kind] = asg.apply
+    app.on_processed = link.ack
+    await link.connect()
+    await app.start()
+    serve = asyncio.create_task(link.serve(app))
+    loop.add_signal_handler(signal.SIGTERM, serve.cancel)
+    try:
+        await serve
+    except asyncio.CancelledError:
+        pass
+    finally:
+        # stop() still processes (and acks) updates already in the queue
+        await app.stop()
+        await link.close()
+        if app.post_stop:
+            await app.post_stop(app)
+        await app.shutdown()
+        if app.post_shutdown:
+            await app.post_shutdown(app)
+
+
+def worker_main(index: int, count: int, socket_path: str) -> None:
+    # Ctrl+C reaches the whole process group; the ingress shuts workers down
+    # in order by closing their connection instead.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    from .main import build_application, configure_db  # bot.main imports this module
+
+    cfg = load_config()
+    configure_db(cfg)
+    app = build_application(cfg, shard_index=index, shard_count=count)
+    link = WorkerLink(index, socket_path)
+    metrics.register("shard", lambda _app: link.metrics())
+    asyncio.run(_run_worker(app, link))
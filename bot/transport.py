@@ -0,0 +1,121 @@
+import asyncio
+import importlib.util
+import time
+from typing import Any, Optional
+
+import httpx
+from telegram.error import TimedOut
+from telegram.request import BaseRequest, HTTPXRequest, RequestData
+
+
+class MeteredRequest(HTTPXRequest):
+    # HTTPXRequest with explicit keep-alive limits and pool metrics.
+    #
+    # Requests pass a semaphore sized to the connection pool before reaching
+    # httpx, so httpx itself never queues: time spent on the semaphore is the
+    # pool wait, and in_flight / pool_size is the saturation.
+
+    def __init__(
+        self,
+        name: str,
+        connection_pool_size: int,
+        keepalive: int,
+        keepalive_expiry: float,
+        connect_timeout: Optional[float],
+        read_timeout: Optional[float],
+        write_timeout: Optional[float],
+        pool_timeout: Optional[float],
+        http_version: str = "1.1",
+    ):
+        limits = httpx.Limits(
+            max_connections=connection_pool_size,
+            max_keepalive_connections=min(keepalive, connection_pool_size),
+            keepalive_expiry=keepalive_expiry,
+        )
+        super().__init__(
+            connection_pool_size=connection_pool_size,
+            connect_timeout=connect_timeout,
+            read_timeout=read_timeout,
+            write_timeout=write_timeout,
+            pool_timeout=pool_timeout,
+            http_version=http_version,
+            httpx_kwargs={"limits": limits},
+        )
+        self.name = name
+        self.pool_size = connection_pool_size
+        self.default_pool_timeout = pool_timeout
+        self.in_flight = 0
+        self.stats = {"requests": 0, "waited": 0, "pool_timeouts": 0, "wait_total_s": 0.0, "wait_max_s": 0.0, "peak_in_flight": 0}
+        self._slots = asyncio.Semaphore(connection_pool_size)
+
+    async def _acquire(self, pool_timeout: Optional[float]) -> None:
+        if not self._slots.locked():
+            await self._slots.acquire()
+            return
+        t0 = time.perf_counter()
+        try:
+            await asyncio.wait_for(self._slots.acquire(), pool_timeout)
+        except asyncio.TimeoutError:
+            self.stats["pool_timeouts"] += 1
+            raise TimedOut(
+                f"Pool timeout: all {self.pool_size} '{self.name}' connections are busy. "
+                "Request was *not* sent to Telegram."
+            ) from None
+        finally:
+            waited = time.perf_counter() - t0
+            self.stats["waited"] += 1
+            self.stats["wait_total_s"] += waited
+            self.stats["wait_max_s"] = max(self.stats["wait_max_s"], waited)
+
+    async def do_request(
+        self,
+        url: str,
+        method: str,
+        request_data: Optional[RequestData] = None,
+        read_timeout=BaseRequest.DEFAULT_NONE,
+        write_timeout=BaseRequest.DEFAULT_NONE,
+        connect_timeout=BaseRequest.DEFAULT_NONE,
+        pool_timeout=BaseRequest.DEFAULT_NONE,
+    ) -> tuple[int, bytes]:
+        await self._acquire(self.default_pool_timeout if pool_timeout is BaseRequest.DEFAULT_NONE else pool_timeout)
+        self.stats["requests"] += 1
+        self.in_flight += 1
+        self.stats["peak_in_flight"] = max(self.stats["peak_in_flight"], self.in_flight)
+        try:
+            return await super().do_request(url, method, request_data, read_timeout, write_timeout, connect_timeout, pool_timeout)
+        finally:
+            self.in_flight -= 1
+            self._slots.release()
+
+    def metrics(self) -> dict[str, Any]:
+        s = self.stats
+        return {
+            "pool_size": self.pool_size,
+            "in_flight": self.in_flight,
+            "saturation": round(self.in_flight / self.pool_size, 3),
+            "peak_in_flight": s["peak_in_flight"],
+            "requests": s["requests"],
+            "waited": s["waited"],
+            "pool_timeouts": s["pool_timeouts"],
+            "wait_avg_ms": round(1000 * s["wait_total_s"] / s["waited"], 2) if s["waited"] else 0.0,
+            "wait_max_ms": round(1000 * s["wait_max_s"], 2),
+        }
+
+
+def build_requests(cfg) -> tuple[MeteredRequest, MeteredRequest]:
+    # (send request, get_updates request)
+    http_version = "2" if cfg.tg_http2 else "1.1"
+    if cfg.tg_http2 and importlib.util.find_spec("h2") is None:
+        raise RuntimeError("TG_HTTP2=1 requires the http2 extra: pip install 'python-telegram-bot[http2]'")
+    common = dict(
+        keepalive=cfg.tg_keepalive,
+        keepalive_expiry=cfg.tg_keepalive_expiry,
+        connect_timeout=cfg.tg_connect_timeout,
+        read_timeout=cfg.tg_read_timeout,
+        write_timeout=cfg.tg_write_timeout,
+        pool_timeout=cfg.tg_pool_timeout,
+        http_version=http_version,
+    )
+    send = MeteredRequest("send", connection_pool_size=cfg.tg_send_pool, **common)
+    updates = MeteredRequest("updates", connection_pool_size=cfg.tg_updates_pool, **common)
+    return send, updates
@@ -0,0 +1,230 @@
+"""End-to-end smoke test of multi-process mode on one machine.
+
+Starts a fake Bot API server, runs `python -m bot.main` with SHARD_WORKERS
+workers against it and feeds messages from several users, then checks:
+
+  * every message reached an admin, in order per user;
+  * each user's updates were handled by worker user_id % N (the rate-limit
+    key lands in that worker's bot_data);
+  * conversations were balanced across the admins, which needs the
+    assignment events to travel between workers;
+  * one text sent by every user reached the admins FLOOD_THRESHOLD times in
+    total, although the copies were spread over all workers.
+
+Run from the repository root (needs the packages from requirements.txt):
+
+    python -m scripts.shard_smoke [--workers 3] [--users 6] [--rounds 3]
+"""
+import argparse
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl
+
+TOKEN = "123:smoke"
+ADMINS = (1, 2)
+BOT_USER = {"id": 999, "is_bot": True, "first_name": "smoke", "username": "smoke_bot"}
+FLOOD_TEXT = "the same announcement, sent by every user"
+FLOOD_THRESHOLD = 3
+
+
+# -------- Fake Bot API --------
+class FakeApi:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.updates: list[dict] = []
+        self.sent: list[tuple[int, str]] = []
+        self.polled = threading.Event()
+        self._next_id = 1
+
+    def push_text(self, user_id: int, text: str) -> None:
+        with self.lock:
+            n = len(self.updates) + 1
+            msg = {
+                "message_id": n,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"},
+                "text": text,
+            }
+            if text.startswith("/"):
+                msg["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+            self.updates.append({"update_id": n, "message": msg})
+
+    def count_sent(self, pred) -> int:
+        with self.lock:
+            return sum(1 for chat, text in self.sent if pred(chat, text))
+
+    def call(self, method: str, params: dict) -> object:
+        if method == "getMe":
+            return BOT_USER
+        if method in ("deleteWebhook", "setMyCommands"):
+            return True
+        if method == "getUpdates":
+            self.polled.set()
+            offset = int(params.get("offset") or 0)
+            deadline = time.time() + min(float(params.get("timeout") or 0), 1.0)
+            while True:
+                with self.lock:
+                    out = [u for u in self.updates if u["update_id"] >= offset]
+                if out or time.time() >= deadline:
+                    return out
+                time.sleep(0.05)
+        chat_id = int(params.get("chat_id") or 0)
+        with self.lock:
+            self.sent.append((chat_id, params.get("text") or params.get("caption") or ""))
+            self._next_id += 1
+            mid = self._next_id
+        return {"message_id": mid, "date": int(time.time()), "chat": {"id": chat_id, "type": "private"}, "from": BOT_USER, "text": params.get("text", "")}
+
+
+def serve(api: FakeApi) -> ThreadingHTTPServer:
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length") or 0)).decode()
+            if self.headers.get("Content-Type", "").startswith("application/json"):
+                params = json.loads(body or "{}")
+            else:
+                params = dict(parse_qsl(body))
+            result = api.call(self.path.rsplit("/", 1)[-1], params)
+            data = json.dumps({"ok": True, "result": result}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            try:
+                self.wfile.write(data)
+            except (BrokenPipeError, ConnectionResetError):
+                pass  # a long poll abandoned at shutdown
+
+        def log_message(self, *args):
+            pass
+
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    return srv
+
+
+def wait_for(pred, timeout: float) -> bool:
+    deadline = time.time() + timeout
+    while not pred():
+        if time.time() > deadline:
+            return False
+        time.sleep(0.1)
+    return True
+
+
+# -------- Checks --------
+def check(api: FakeApi, db_path: str, workers: int, users: list[int], rounds: int) -> list[str]:
+    import sqlite3
+
+    errors = []
+    owners: dict[int, set[int]] = {}
+    for uid in users:
+        got = [(chat, text.rsplit("\n", 1)[-1]) for chat, text in api.sent if chat in ADMINS and f"ID: {uid}\n" in text]
+        got = [(chat, t) for chat, t in got if t != FLOOD_TEXT]
+        want = [f"u{uid} m{k}" for k in range(rounds)]
+        if [t for _, t in got] != want:
+            errors.append(f"user {uid}: admins received {[t for _, t in got]}, expected {want}")
+        owners[uid] = {chat for chat, _ in got}
+        if len(owners[uid]) > 1:
+            errors.append(f"user {uid}: conversation split across admins {sorted(owners[uid])}")
+
+    per_admin = {a: sum(1 for o in owners.values() if o == {a}) for a in ADMINS}
+    if max(per_admin.values()) - min(per_admin.values()) > 1:
+        errors.append(f"unbalanced assignment {per_admin}: events between workers not applied")
+
+    copies = api.count_sent(lambda c, t: c in ADMINS and t.endswith("\n" + FLOOD_TEXT))
+    if copies != min(FLOOD_THRESHOLD, len(users)):
+        errors.append(f"duplicate text relayed {copies} times, expected {min(FLOOD_THRESHOLD, len(users))} (flood counts not shared)")
+
+    con = sqlite3.connect(db_path)
+    rows = con.execute("SELECT owner_id, key FROM context_data WHERE scope='bot' AND key LIKE 'rl:%'").fetchall()
+    con.close()
+    seen = {int(key[3:]): owner for owner, key in rows}
+    for uid in users:
+        if seen.get(uid) != uid % workers:
+            errors.append(f"user {uid}: handled by worker {seen.get(uid)}, expected {uid % workers}")
+    print(f"  conversations per admin: {per_admin}")
+    print(f"  users per worker: { {w: sorted(u for u in users if seen.get(u) == w) for w in range(workers)} }")
+    return errors
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--workers", type=int, default=3)
+    ap.add_argument("--users", type=int, default=6)
+    ap.add_argument("--rounds", type=int, default=3, help="messages per user")
+    args = ap.parse_args()
+
+    api = FakeApi()
+    srv = serve(api)
+    tmp = tempfile.mkdtemp(prefix="shard-smoke-")
+    db_path = os.path.join(tmp, "bot.db")
+    users = [101 + i for i in range(args.users)]
+    env = dict(
+        os.environ,
+        BOT_TOKEN=TOKEN,
+        ADMIN_ID=str(ADMINS[0]),
+        ADMIN_IDS=",".join(map(str, ADMINS)),
+        ALLOWED_USER_IDS=",".join(map(str, ADMINS + tuple(users))),
+        DB_PATH=db_path,
+        BACKUP_DIR=os.path.join(tmp, "backups"),
+        BACKUP_INTERVAL="0",
+        FLOOD_THRESHOLD=str(FLOOD_THRESHOLD),
+        SHARD_WORKERS=str(args.workers),
+        SHARD_SOCKET=os.path.join(tmp, "shard.sock"),
+        TG_BASE_URL=f"http://127.0.0.1:{srv.server_address[1]}/bot",
+    )
+    proc = subprocess.Popen([sys.executable, "-m", "bot.main"], env=env)
+    try:
+        if not api.polled.wait(30):
+            sys.exit("ingress never polled the fake Bot API")
+        # Workers take a few seconds to start; updates routed before then wait
+        # at the ingress. A /help per worker shows they are all serving.
+        probes = {uid % args.workers: uid for uid in reversed(users)}
+        for uid in probes.values():
+            api.push_text(uid, "/help")
+        if not wait_for(lambda: all(api.count_sent(lambda c, _t: c == uid) for uid in probes.values()), 60):
+            sys.exit("workers did not answer /help")
+        # The bot rate-limits each user to one message per 3 seconds. Users are
+        # staggered so each new conversation's assignment event reaches the
+        # other workers before the next one is picked; simultaneous first
+        # messages on different workers may both go to the least-loaded admin.
+        for k in range(args.rounds):
+            for uid in users:
+                api.push_text(uid, f"u{uid} m{k}")
+                time.sleep(0.3)
+            relayed = len(users) * (k + 1)
+            wait_for(lambda: api.count_sent(lambda c, t: c in ADMINS and t.startswith("From:")) >= relayed, 30)
+            time.sleep(3.2)
+        for uid in users:
+            api.push_text(uid, FLOOD_TEXT)
+        relayed = len(users) * args.rounds + min(FLOOD_THRESHOLD, len(users))
+        wait_for(lambda: api.count_sent(lambda c, t: c in ADMINS and t.startswith("From:")) >= relayed, 30)
+        time.sleep(2)  # any copy beyond the threshold would show up by now
+    finally:
+        proc.send_signal(signal.SIGINT)
+        try:
+            proc.wait(60)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+        srv.shutdown()
+
+    print(f"{args.workers} workers, {len(users)} users, {args.rounds} messages each:")
+    errors = check(api, db_path, args.workers, users, args.rounds)
+    for e in errors:
+        print(f"FAIL {e}")
+    if errors:
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()